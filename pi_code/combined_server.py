@@ -2,11 +2,13 @@ import threading
 import socket
 import os
 import cv2
-from flask import Flask, Response
+from flask import Flask, Response, request
 import logging
 import time
 import signal
 import sys
+from frame_broadcast import FrameBroadcaster
+from mjpeg_capture import enable_passthrough, read_jpeg
 
 # --- Handshaker logic ---
 def handshaker(stop_event):
@@ -44,10 +46,14 @@ app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 
 cameras = {}
-latest_frames = {}
-frame_locks = {}
+broadcasters = {}  # camera index -> FrameBroadcaster with the latest JPEG
+capture_modes = {}  # camera index -> "passthrough" or "encode"
 available_cameras = []
 
+# serve the cameras' own MJPEG buffers instead of decoding and re-encoding every frame
+MJPEG_PASSTHROUGH = True
+JPEG_QUALITY = 70  # used when the frames have to be encoded on the Pi
+
 def setup_camera(camera_index):
     camera = cv2.VideoCapture(camera_index, cv2.CAP_V4L2)
     if not camera.isOpened():
@@ -55,6 +61,8 @@ def setup_camera(camera_index):
     if not camera.isOpened():
         return None
     camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))
+    if MJPEG_PASSTHROUGH:
+        enable_passthrough(camera)
     camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
     camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
     camera.set(cv2.CAP_PROP_FPS, 15)
@@ -72,12 +80,13 @@ def setup_camera(camera_index):
 
 def capture_frames(camera_index, stop_event):
     camera = cameras[camera_index]
-    jpeg_encode_params = [cv2.IMWRITE_JPEG_QUALITY, 70]
+    jpeg_encode_params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
     time.sleep(1)
     consecutive_failures = 0
     max_failures = 10
+    passthrough = None
     while not stop_event.is_set():
-        success, frame = camera.read()
+        success, frame_bytes, used_passthrough = read_jpeg(camera, jpeg_encode_params)
         if not success:
             consecutive_failures += 1
             if consecutive_failures >= max_failures:
@@ -88,6 +97,7 @@ def capture_frames(camera_index, stop_event):
                     cameras[camera_index] = new_camera
                     camera = new_camera
                     consecutive_failures = 0
+                    continue  # no frame to publish yet
                 else:
                     time.sleep(5)
                     continue
@@ -96,28 +106,31 @@ def capture_frames(camera_index, stop_event):
                 continue
         else:
             consecutive_failures = 0
-        ret, buffer = cv2.imencode(".jpg", frame, jpeg_encode_params)
-        if ret:
-            with frame_locks[camera_index]:
-                latest_frames[camera_index] = buffer.tobytes()
+            if used_passthrough != passthrough:
+                passthrough = used_passthrough
+                capture_modes[camera_index] = "passthrough" if passthrough else "encode"
+                print(f"Camera {camera_index}: {'MJPEG passthrough' if passthrough else 'decode and re-encode'}")
+        broadcasters[camera_index].publish(frame_bytes)
         time.sleep(0.01)
 
-def generate_frames(camera_index):
-    while True:
-        with frame_locks[camera_index]:
-            if camera_index in latest_frames:
-                frame_bytes = latest_frames[camera_index]
-                yield (
-                    b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + frame_bytes + b"\r\n"
-                )
-        time.sleep(1/30)
+def generate_frames(camera_index, args, sock=None):
+    # ?fps= caps the rate, ?quality= and ?width= ask for a re-encoded stream and
+    # ?adaptive=1 lowers quality and size while the client's send queue backs up
+    return broadcasters[camera_index].stream(
+        max_fps=args.get("fps", type=float),
+        quality=args.get("quality", type=int),
+        width=args.get("width", type=int),
+        adaptive=args.get("adaptive", "0").lower() not in ("0", "false", "no", ""),
+        sock=sock,
+    )
 
 @app.route("/video_feed_1")
 def video_feed_1():
     if len(available_cameras) < 1:
         return "No cameras available", 404
     return Response(
-        generate_frames(available_cameras[0]), mimetype="multipart/x-mixed-replace; boundary=frame"
+        generate_frames(available_cameras[0], request.args, request.environ.get("werkzeug.socket")),
+        mimetype="multipart/x-mixed-replace; boundary=frame"
     )
 
 @app.route("/video_feed_2")
@@ -125,9 +138,21 @@ def video_feed_2():
     if len(available_cameras) < 2:
         return "Camera 2 not available", 404
     return Response(
-        generate_frames(available_cameras[1]), mimetype="multipart/x-mixed-replace; boundary=frame"
+        generate_frames(available_cameras[1], request.args, request.environ.get("werkzeug.socket")),
+        mimetype="multipart/x-mixed-replace; boundary=frame"
     )
 
+@app.route("/thumbnail_<int:feed_number>")
+def thumbnail(feed_number):
+    # the only place the server needs pixels: decode the newest JPEG at 1/4 size
+    if feed_number < 1 or len(available_cameras) < feed_number or available_cameras[feed_number - 1] not in broadcasters:
+        return "Camera not available", 404
+    frame = broadcasters[available_cameras[feed_number - 1]].decoded(scale=4)
+    if frame is None:
+        return "No frame yet", 503
+    ret, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+    return Response(buffer.tobytes(), mimetype="image/jpeg")
+
 @app.route("/status")
 def status():
     status_info = {
@@ -135,11 +160,21 @@ def status():
         "camera_status": {}
     }
     for cam_idx in available_cameras:
-        has_frame = cam_idx in latest_frames and latest_frames[cam_idx] is not None
         status_info["camera_status"][cam_idx] = {
-            "has_recent_frame": has_frame,
+            "has_recent_frame": False,
             "camera_active": cam_idx in cameras
         }
+        if cam_idx in cameras:
+            camera = cameras[cam_idx]
+            status_info["camera_status"][cam_idx]["capture"] = {
+                "width": camera.get(cv2.CAP_PROP_FRAME_WIDTH),
+                "height": camera.get(cv2.CAP_PROP_FRAME_HEIGHT),
+                "fps": camera.get(cv2.CAP_PROP_FPS),
+                "mode": capture_modes.get(cam_idx, "starting"),
+                "encode_quality": JPEG_QUALITY,
+            }
+        if cam_idx in broadcasters:
+            status_info["camera_status"][cam_idx].update(broadcasters[cam_idx].status())
     return status_info
 
 def video_feeder(stop_event):
@@ -157,8 +192,7 @@ def video_feeder(stop_event):
         if camera is None:
             continue
         cameras[camera_index] = camera
-        latest_frames[camera_index] = None
-        frame_locks[camera_index] = threading.Lock()
+        broadcasters[camera_index] = FrameBroadcaster()
         capture_thread = threading.Thread(target=capture_frames, args=(camera_index, stop_event), daemon=True)
         capture_thread.start()
     time.sleep(5)
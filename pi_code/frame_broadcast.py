@@ -0,0 +1,271 @@
+import collections
+import fcntl
+import itertools
+import struct
+import termios
+import threading
+import time
+
+import cv2
+
+from mjpeg_capture import decode_jpeg, encode_jpeg, jpeg_size
+
+# (decode scale, JPEG quality) steps used by adaptive clients, best first.
+# Quality None means the camera's JPEG is sent untouched.
+ADAPTIVE_LEVELS = [(1, None), (1, 50), (2, 60), (2, 40), (4, 40)]
+DEFAULT_QUALITY = 70  # JPEG quality of a client that only asked for a smaller width
+ADAPTIVE_HOLD = 1.0  # seconds between two adaptive steps
+THROUGHPUT_WINDOW = 2.0  # seconds over which /status throughput is averaged
+
+
+def unsent_bytes(sock):
+    """Bytes still waiting in the socket's kernel send queue, None if unknown."""
+    try:
+        result = fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, struct.pack("I", 0))
+        return struct.unpack("I", result)[0]
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class ClientStream:
+    """Encode settings and counters of one connected client."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, max_fps=None, quality=None, width=None, adaptive=False, sock=None):
+        self.id = next(self._ids)
+        self.max_fps = max_fps
+        self.quality = quality
+        self.width = width
+        self.adaptive = adaptive
+        self.sock = sock
+        self.level = 0
+        self.last_step = 0.0
+        self.clear_frames = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    def settings(self, native_width):
+        """Return (output width or None, quality or None) for the next frame."""
+        if self.adaptive:
+            scale, quality = ADAPTIVE_LEVELS[self.level]
+            width = native_width // scale if native_width and scale > 1 else None
+            return width, quality
+        width = self.width if self.width and native_width and self.width < native_width else None
+        return width, self.quality or (DEFAULT_QUALITY if width else None)
+
+    def adapt(self, frame_size, send_time, frame_interval):
+        """Step quality down when the send queue backs up and up again once it drains."""
+        if not self.adaptive:
+            return
+        backlog = unsent_bytes(self.sock) if self.sock is not None else None
+        if backlog is not None:
+            congested = backlog > 2 * frame_size
+            clear = backlog < frame_size // 4
+        else:
+            # no queue size available, fall back to how long the write blocked
+            congested = send_time > 0.5 * frame_interval
+            clear = send_time < 0.1 * frame_interval
+        now = time.monotonic()
+        self.clear_frames = self.clear_frames + 1 if clear else 0
+        if now - self.last_step < ADAPTIVE_HOLD:
+            return
+        if congested and self.level < len(ADAPTIVE_LEVELS) - 1:
+            self.level += 1
+            self.last_step = now
+        elif self.clear_frames >= 15 and self.level > 0:
+            self.level -= 1
+            self.last_step = now
+            self.clear_frames = 0
+
+    def status(self, native_width=None):
+        info = {
+            "max_fps": self.max_fps,
+            "adaptive": self.adaptive,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+        }
+        if self.adaptive:
+            scale, quality = ADAPTIVE_LEVELS[self.level]
+            info.update(level=self.level, scale=scale, quality=quality or "camera")
+        else:
+            # what the client actually gets, a width at or above the camera's is sent as is
+            width, quality = self.settings(native_width)
+            info.update(width=width or "camera", quality=quality or "camera")
+        return info
+
+
+class FrameBroadcaster:
+    """Hands the newest JPEG of one camera to every connected HTTP client.
+
+    The capture thread publishes each encoded frame once and bumps a generation
+    counter; clients block on a condition until the generation changes, so each
+    frame is sent exactly once and as soon as it exists. A client that is slower
+    than the camera simply picks up the newest frame next, older ones are dropped.
+    Clients asking for a different size or quality get a transcoded copy, shared
+    between all clients with the same settings.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.frame = None
+        self.generation = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self._clients = {}  # id -> ClientStream
+        self._decoded = {}  # scale -> (generation, BGR frame)
+        self._transcoded = {}  # (width, quality) -> (generation, JPEG bytes)
+        self._transcode_locks = {}  # (width, quality) -> lock held while that frame is encoded
+        self._native_size = None
+        self._sent_log = collections.deque()  # (time, bytes) for the throughput figure
+
+    @property
+    def clients(self):
+        return len(self._clients)
+
+    def publish(self, frame_bytes):
+        if frame_bytes is None:
+            # waiters treat a None frame as a timeout and would spin on this generation
+            return
+        with self._cond:
+            self.frame = frame_bytes
+            self.generation += 1
+            self._cond.notify_all()
+
+    def wait_for_frame(self, last_generation, timeout=1.0):
+        """Block until a frame newer than last_generation exists.
+
+        Returns (generation, frame_bytes), or (last_generation, None) on timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.generation != last_generation, timeout):
+                return last_generation, None
+            return self.generation, self.frame
+
+    def stream(self, max_fps=None, quality=None, width=None, adaptive=False, sock=None, stop_event=None):
+        """Multipart generator for a Flask Response.
+
+        max_fps caps the client's frame rate, quality and width ask for a
+        re-encoded stream. With adaptive set, quality and size follow the
+        client's send queue instead (sock is the client's socket).
+        """
+        client = ClientStream(max_fps, quality, width, adaptive, sock)
+        min_interval = 1.0 / max_fps if max_fps else 0.0
+        last_generation = self.generation if self.frame is None else self.generation - 1
+        next_send = 0.0
+        last_frame_time = None
+        with self._cond:
+            self._clients[client.id] = client
+        try:
+            while stop_event is None or not stop_event.is_set():
+                if min_interval:
+                    delay = next_send - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                generation, frame_bytes = self.wait_for_frame(last_generation)
+                if frame_bytes is None:
+                    continue
+                if generation - last_generation > 1:
+                    with self._cond:
+                        self.frames_dropped += generation - last_generation - 1
+                last_generation = generation
+                now = time.monotonic()
+                frame_interval = now - last_frame_time if last_frame_time is not None else None
+                last_frame_time = now
+                next_send = now + min_interval
+
+                out_width, out_quality = client.settings(self._frame_width(frame_bytes))
+                if out_width or out_quality:
+                    frame_bytes = self.transcoded(generation, frame_bytes, out_width, out_quality)
+                    if frame_bytes is None:
+                        continue
+
+                client.frames_sent += 1
+                client.bytes_sent += len(frame_bytes)
+                with self._cond:
+                    self.frames_sent += 1
+                    self._sent_log.append((now, len(frame_bytes)))
+                send_start = time.monotonic()
+                yield (
+                    b"--frame\r\n"
+                    b"Content-Type: image/jpeg\r\n"
+                    b"Content-Length: " + str(len(frame_bytes)).encode() + b"\r\n\r\n"
+                    + frame_bytes + b"\r\n"
+                )
+                # the server resumes the generator once the write returned
+                if frame_interval:
+                    client.adapt(len(frame_bytes), time.monotonic() - send_start, frame_interval)
+        finally:
+            with self._cond:
+                self._clients.pop(client.id, None)
+
+    def _frame_width(self, frame_bytes):
+        if self._native_size is None:
+            self._native_size = jpeg_size(frame_bytes)
+        return self._native_size[0] if self._native_size else None
+
+    def transcoded(self, generation, frame_bytes, width, quality):
+        """Re-encode a frame at the given width and quality, cached per generation.
+
+        Clients with the same settings wait for the one already encoding the
+        frame instead of encoding it again.
+        """
+        key = (width, quality)
+        with self._cond:
+            lock = self._transcode_locks.setdefault(key, threading.Lock())
+        with lock:
+            cached = self._transcoded.get(key)
+            if cached is not None and cached[0] == generation:
+                return cached[1]
+            native_width = self._frame_width(frame_bytes)
+            scale = 1
+            if width and native_width:
+                # let libjpeg do most of the downscaling while decoding
+                while scale < 8 and native_width // (scale * 2) >= width:
+                    scale *= 2
+            frame = decode_jpeg(frame_bytes, scale)
+            if frame is None:
+                return None
+            if width and frame.shape[1] != width:
+                height = round(frame.shape[0] * width / frame.shape[1])
+                frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            jpeg = encode_jpeg(frame, quality)
+            self._transcoded[key] = (generation, jpeg)
+            return jpeg
+
+    def decoded(self, scale=1):
+        """Decode the newest JPEG on demand, for server side features that need pixels.
+
+        The result is cached per generation, so several callers share one decode.
+        """
+        with self._cond:
+            generation, frame_bytes = self.generation, self.frame
+        if frame_bytes is None:
+            return None
+        cached = self._decoded.get(scale)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        frame = decode_jpeg(frame_bytes, scale)
+        self._decoded[scale] = (generation, frame)
+        return frame
+
+    def throughput(self):
+        """Bytes per second sent to all clients over the last THROUGHPUT_WINDOW seconds."""
+        cutoff = time.monotonic() - THROUGHPUT_WINDOW
+        with self._cond:
+            while self._sent_log and self._sent_log[0][0] < cutoff:
+                self._sent_log.popleft()
+            return sum(size for _, size in self._sent_log) / THROUGHPUT_WINDOW
+
+    def status(self):
+        native_width = self._native_size[0] if self._native_size else None
+        return {
+            "has_recent_frame": self.frame is not None,
+            "generation": self.generation,
+            "frame_size": self._native_size,
+            "clients": self.clients,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "bytes_per_s": round(self.throughput()),
+            "client_streams": [client.status(native_width) for client in list(self._clients.values())],
+        }
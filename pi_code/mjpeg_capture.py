@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+
+JPEG_SOI = b"\xff\xd8"
+
+# cv2.imdecode flags that decode straight to a reduced size, much cheaper than
+# decoding the full frame and resizing it afterwards
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def enable_passthrough(camera):
+    """Ask the V4L2 backend to return the camera's MJPEG buffers without decoding them."""
+    return camera.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
+
+def read_jpeg(camera, jpeg_encode_params):
+    """Read one frame from the camera as JPEG bytes.
+
+    With passthrough enabled the V4L2 backend returns the compressed buffer as
+    a single row of bytes, which is served as is. If the backend ignored the
+    request and returned a decoded BGR frame, it is encoded instead.
+    Returns (success, jpeg_bytes, passthrough).
+    """
+    success, frame = camera.read()
+    if not success or frame is None:
+        return False, None, False
+    if frame.ndim == 1 or (frame.ndim == 2 and frame.shape[0] == 1):
+        data = frame.tobytes()
+        if data[:2] == JPEG_SOI:
+            return True, data, True
+        return False, None, True
+    ret, buffer = cv2.imencode(".jpg", frame, jpeg_encode_params)
+    if not ret:
+        return False, None, False
+    return True, buffer.tobytes(), False
+
+
+def decode_jpeg(jpeg_bytes, scale=1):
+    """Decode JPEG bytes to BGR, scale 2, 4 or 8 decodes at a reduced size."""
+    return cv2.imdecode(np.frombuffer(jpeg_bytes, dtype=np.uint8), REDUCED_DECODE_FLAGS[scale])
+
+
+def encode_jpeg(frame, quality):
+    ret, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    return buffer.tobytes() if ret else None
+
+
+def jpeg_size(jpeg_bytes):
+    """Return (width, height) from the JPEG frame header without decoding, or None."""
+    i = 2
+    n = len(jpeg_bytes)
+    while i + 9 < n:
+        if jpeg_bytes[i] != 0xFF:
+            return None
+        marker = jpeg_bytes[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        length = (jpeg_bytes[i + 2] << 8) | jpeg_bytes[i + 3]
+        # SOFn markers, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (jpeg_bytes[i + 5] << 8) | jpeg_bytes[i + 6]
+            width = (jpeg_bytes[i + 7] << 8) | jpeg_bytes[i + 8]
+            return width, height
+        i += 2 + length
+    return None
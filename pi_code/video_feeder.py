@@ -1,8 +1,10 @@
 import cv2
-from flask import Flask, Response
+from flask import Flask, Response, request
 import logging
 import threading
 import time
+from frame_broadcast import FrameBroadcaster
+from mjpeg_capture import enable_passthrough, read_jpeg
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -12,10 +14,14 @@ logging.info("Flask app is running")
 
 # Global camera objects and frame storage
 cameras = {}
-latest_frames = {}
-frame_locks = {}
+broadcasters = {}  # camera index -> FrameBroadcaster with the latest JPEG
+capture_modes = {}  # camera index -> "passthrough" or "encode"
 available_cameras = []  # Global list of available camera indices
 
+# Serve the cameras' own MJPEG buffers instead of decoding and re-encoding every frame
+MJPEG_PASSTHROUGH = True
+JPEG_QUALITY = 70  # used when the frames have to be encoded on the Pi
+
 def setup_camera(camera_index):
     """Setup camera with optimized settings for Raspberry Pi"""
     logging.info(f"Setting up camera {camera_index}")
@@ -34,6 +40,10 @@ def setup_camera(camera_index):
     # Set codec first (important for USB cameras)
     camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))
     
+    # Get the compressed MJPEG buffers straight from V4L2
+    if MJPEG_PASSTHROUGH:
+        enable_passthrough(camera)
+    
     # Set resolution
     camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
     camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
@@ -66,7 +76,7 @@ def setup_camera(camera_index):
 def capture_frames(camera_index):
     """Continuously capture frames in a separate thread"""
     camera = cameras[camera_index]
-    jpeg_encode_params = [cv2.IMWRITE_JPEG_QUALITY, 70]  # Reduce quality for speed
+    jpeg_encode_params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]  # Reduce quality for speed
     
     # Give camera time to warm up
     time.sleep(1)
@@ -74,8 +84,9 @@ def capture_frames(camera_index):
     consecutive_failures = 0
     max_failures = 10
     
+    passthrough = None
     while True:
-        success, frame = camera.read()
+        success, frame_bytes, used_passthrough = read_jpeg(camera, jpeg_encode_params)
         if not success:
             consecutive_failures += 1
             logging.error(f"Camera {camera_index} failed to read frame (failure #{consecutive_failures})")
@@ -92,6 +103,7 @@ def capture_frames(camera_index):
                     camera = new_camera
                     consecutive_failures = 0
                     logging.info(f"Camera {camera_index} successfully reinitialized")
+                    continue  # no frame to publish yet
                 else:
                     logging.error(f"Failed to reinitialize camera {camera_index}")
                     time.sleep(5)  # Wait longer before trying again
@@ -101,26 +113,28 @@ def capture_frames(camera_index):
                 continue
         else:
             consecutive_failures = 0  # Reset failure counter on success
+            if used_passthrough != passthrough:
+                passthrough = used_passthrough
+                capture_modes[camera_index] = "passthrough" if passthrough else "encode"
+                logging.info(f"Camera {camera_index}: {'MJPEG passthrough' if passthrough else 'decode and re-encode'}")
             
-        # Encode frame to JPEG
-        ret, buffer = cv2.imencode(".jpg", frame, jpeg_encode_params)
-        if ret:
-            with frame_locks[camera_index]:
-                latest_frames[camera_index] = buffer.tobytes()
+        # Frames are already JPEG, either from the camera or encoded by read_jpeg
+        broadcasters[camera_index].publish(frame_bytes)
         
         # Small delay to prevent overwhelming the CPU
         time.sleep(0.01)
 
-def generate_frames(camera_index):
-    """Generate frames from the latest captured frame"""
-    while True:
-        with frame_locks[camera_index]:
-            if camera_index in latest_frames:
-                frame_bytes = latest_frames[camera_index]
-                yield (
-                    b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + frame_bytes + b"\r\n"
-                )
-        time.sleep(1/30)  # Limit streaming to 30fps max
+def generate_frames(camera_index, args, sock=None):
+    """Stream every new frame once, with the encode settings the client asked for"""
+    # ?fps= caps the rate, ?quality= and ?width= ask for a re-encoded stream and
+    # ?adaptive=1 lowers quality and size while the client's send queue backs up
+    return broadcasters[camera_index].stream(
+        max_fps=args.get("fps", type=float),
+        quality=args.get("quality", type=int),
+        width=args.get("width", type=int),
+        adaptive=args.get("adaptive", "0").lower() not in ("0", "false", "no", ""),
+        sock=sock,
+    )
 
 
 @app.route("/video_feed_1")
@@ -129,7 +143,8 @@ def video_feed_1():
         return "No cameras available", 404
     logging.info("Starting the video feed 1")
     return Response(
-        generate_frames(available_cameras[0]), mimetype="multipart/x-mixed-replace; boundary=frame"
+        generate_frames(available_cameras[0], request.args, request.environ.get("werkzeug.socket")),
+        mimetype="multipart/x-mixed-replace; boundary=frame"
     )
 
 
@@ -139,10 +154,23 @@ def video_feed_2():
         return "Camera 2 not available", 404
     logging.info("Starting the video feed 2")
     return Response(
-        generate_frames(available_cameras[1]), mimetype="multipart/x-mixed-replace; boundary=frame"
+        generate_frames(available_cameras[1], request.args, request.environ.get("werkzeug.socket")),
+        mimetype="multipart/x-mixed-replace; boundary=frame"
     )
 
 
+@app.route("/thumbnail_<int:feed_number>")
+def thumbnail(feed_number):
+    # the only place the server needs pixels: decode the newest JPEG at 1/4 size
+    if feed_number < 1 or len(available_cameras) < feed_number or available_cameras[feed_number - 1] not in broadcasters:
+        return "Camera not available", 404
+    frame = broadcasters[available_cameras[feed_number - 1]].decoded(scale=4)
+    if frame is None:
+        return "No frame yet", 503
+    ret, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+    return Response(buffer.tobytes(), mimetype="image/jpeg")
+
+
 @app.route("/status")
 def status():
     """Check camera status"""
@@ -152,11 +180,21 @@ def status():
     }
     
     for cam_idx in available_cameras:
-        has_frame = cam_idx in latest_frames and latest_frames[cam_idx] is not None
         status_info["camera_status"][cam_idx] = {
-            "has_recent_frame": has_frame,
+            "has_recent_frame": False,
             "camera_active": cam_idx in cameras
         }
+        if cam_idx in cameras:
+            camera = cameras[cam_idx]
+            status_info["camera_status"][cam_idx]["capture"] = {
+                "width": camera.get(cv2.CAP_PROP_FRAME_WIDTH),
+                "height": camera.get(cv2.CAP_PROP_FRAME_HEIGHT),
+                "fps": camera.get(cv2.CAP_PROP_FPS),
+                "mode": capture_modes.get(cam_idx, "starting"),
+                "encode_quality": JPEG_QUALITY,
+            }
+        if cam_idx in broadcasters:
+            status_info["camera_status"][cam_idx].update(broadcasters[cam_idx].status())
     
     return status_info
 
@@ -185,8 +223,7 @@ if __name__ == "__main__":
             continue
             
         cameras[camera_index] = camera
-        latest_frames[camera_index] = None
-        frame_locks[camera_index] = threading.Lock()
+        broadcasters[camera_index] = FrameBroadcaster()
         
         # Start capture thread for each camera
         capture_thread = threading.Thread(target=capture_frames, args=(camera_index,), daemon=True)
@@ -36,6 +36,33 @@ IPAddress pcIP;
 // variable to store the port
 int pcPort;
 
+// telemetry format, the pc switches to binary with "telemetry: binary"
+// text ("data\nKey: value" lines) stays the default for older pc software
+bool binaryTelemetry = false;
+uint32_t telemetrySeq = 0;
+
+// Binary telemetry frame, must match TELEMETRY_STRUCT in top_pc/parse_data.py
+// (little endian, packed, 40 bytes)
+#define TELEMETRY_VERSION 1
+#define DEPTH_STATUS_BIT 0x01
+#define IMU_STATUS_BIT 0x02
+
+struct __attribute__((packed)) TelemetryFrame
+{
+  char magic[2];        // "BT"
+  uint8_t version;      // TELEMETRY_VERSION
+  uint8_t flags;        // DEPTH_STATUS_BIT | IMU_STATUS_BIT
+  uint32_t seq;         // incremented for every frame sent
+  uint32_t deviceTime;  // millis() when the sensors were read
+  float pressure;
+  float temperature;
+  float depth;
+  float altitude;
+  float roll;
+  float pitch;
+  float yaw;
+};
+
 #define SERVO1_PWM_PIN 2 // MAIN SERVO
 #define SERVO2_PWM_PIN 3 // TAIL SERVO TOP
 #define SERVO3_PWM_PIN 4 // TAIL SERVO BOTTOM LEFT (LOOKING FORWARD ORIENTATION)
@@ -256,6 +283,11 @@ void loop()
       }
       // ----------------------------
     }
+    else if (get_command(packetBuffer, "telemetry"))
+    {
+      // "telemetry: binary" or "telemetry: text"
+      binaryTelemetry = strstr(packetBuffer, "binary") != NULL;
+    }
     else if (strcmp(packetBuffer, "refresh") == 0)
     {
       // recheck status of sensors
@@ -280,27 +312,47 @@ void loop()
   // returns {roll, pitch, yaw};
   float euler[3];
   imuStatus = read_euler(euler);
-  // make string to store sensor data
-  String data = String(
-    "data" + String("\n") +
-    "Pressure: " + String(sensor.pressure()) + String("\n") +
-    "Temperature: " + String(sensor.temperature()) + String("\n") +
-    "Depth: " + String(sensor.depth()) + String("\n") +
-    "Altitude: " + String(sensor.altitude()) + String("\n") +
-    "Roll: " + String(euler[0]) + String("\n") +
-    "Pitch: " + String(euler[1]) + String("\n") +
-    "Yaw: " + String(euler[2]) + String("\n") +
-    "depthStatus: " + String(depthStatus) + String("\n") +
-    "imuStatus: " + String(imuStatus) + String("\n")
-  );
-  const char* dataChar = data.c_str();
   if (!pc_connection)
   {
     Serial.println("No PC connection");
     delay(2000);
   }
+  else if (binaryTelemetry)
+  {
+    TelemetryFrame frame;
+    frame.magic[0] = 'B';
+    frame.magic[1] = 'T';
+    frame.version = TELEMETRY_VERSION;
+    frame.flags = (depthStatus ? DEPTH_STATUS_BIT : 0) | (imuStatus ? IMU_STATUS_BIT : 0);
+    frame.seq = telemetrySeq++;
+    frame.deviceTime = millis();
+    frame.pressure = sensor.pressure();
+    frame.temperature = sensor.temperature();
+    frame.depth = sensor.depth();
+    frame.altitude = sensor.altitude();
+    frame.roll = euler[0];
+    frame.pitch = euler[1];
+    frame.yaw = euler[2];
+    Udp.beginPacket(pcIP, pcPort);
+    Udp.write((const uint8_t *)&frame, sizeof(frame));
+    Udp.endPacket();
+  }
   else
   {
+    // make string to store sensor data
+    String data = String(
+      "data" + String("\n") +
+      "Pressure: " + String(sensor.pressure()) + String("\n") +
+      "Temperature: " + String(sensor.temperature()) + String("\n") +
+      "Depth: " + String(sensor.depth()) + String("\n") +
+      "Altitude: " + String(sensor.altitude()) + String("\n") +
+      "Roll: " + String(euler[0]) + String("\n") +
+      "Pitch: " + String(euler[1]) + String("\n") +
+      "Yaw: " + String(euler[2]) + String("\n") +
+      "depthStatus: " + String(depthStatus) + String("\n") +
+      "imuStatus: " + String(imuStatus) + String("\n")
+    );
+    const char* dataChar = data.c_str();
     Udp.beginPacket(pcIP, pcPort);
     Udp.write(dataChar);
     Udp.endPacket();
@@ -2,6 +2,15 @@ import torch
 import torch.nn as nn
 
 
+# architectures whose forward normalizes the grid (and takes normalize=False)
+NORMALIZED_ARCS = ("ImageReducer_bounded", "ImageReducer_bounded_grayscale", "ImageReducer_bounded_grayscale_q")
+
+
+def normalize_peak(x):
+    # Normalize each sample between 0 and 1 by its own peak
+    return x / x.amax(dim=(1, 2, 3), keepdim=True)
+
+
 class ImageReducer(nn.Module):
     def __init__(self):
         super(ImageReducer, self).__init__()
@@ -30,16 +39,15 @@ class ImageReducer_bounded(nn.Module):
         self.conv4 = nn.Conv2d(256, 512, kernel_size=3, stride=1, padding=0)
         self.conv5 = nn.Conv2d(512, 1, kernel_size=3, stride=1, padding=0)
 
-    def forward(self, x):
+    def forward(self, x, normalize=True):
         x = torch.relu(self.conv1(x))
         x = torch.relu(self.conv2(x))
         x = torch.relu(self.conv3(x))
         x = torch.relu(self.conv4(x))
         x = torch.relu(self.conv5(x))
 
-        # Normalize between 0 and 1
-        x = x / torch.max(x)
-        return x
+        # normalize=False returns the raw activation, e.g. to compare its peak across frames
+        return normalize_peak(x) if normalize else x
 
 
 class ImageReducer_bounded_grayscale(nn.Module):
@@ -51,20 +59,22 @@ class ImageReducer_bounded_grayscale(nn.Module):
         self.conv4 = nn.Conv2d(256, 512, kernel_size=3, stride=1, padding=0)
         self.conv5 = nn.Conv2d(512, 1, kernel_size=3, stride=1, padding=0)
 
-    def forward(self, x):
+    def forward(self, x, normalize=True):
         x = torch.relu(self.conv1(x))
         x = torch.relu(self.conv2(x))
         x = torch.relu(self.conv3(x))
         x = torch.relu(self.conv4(x))
         x = torch.relu(self.conv5(x))
 
-        # Normalize between 0 and 1
-        x = x / torch.max(x)
-        return x
+        # normalize=False returns the raw activation, e.g. to compare its peak across frames
+        return normalize_peak(x) if normalize else x
 
 class ImageReducer_bounded_grayscale_q(nn.Module):
+    # Same layers and weights as ImageReducer_bounded_grayscale, with the stubs
+    # and ReLU modules eager mode static quantization needs, see quantize_grid.py
     def __init__(self):
         super(ImageReducer_bounded_grayscale_q, self).__init__()
+        self.quant = torch.quantization.QuantStub()
         self.conv1 = nn.Conv2d(1, 64, kernel_size=3, stride=2, padding=0)
         self.relu1 = nn.ReLU()
         self.conv2 = nn.Conv2d(64, 128, kernel_size=3, stride=2, padding=0)
@@ -75,18 +85,21 @@ class ImageReducer_bounded_grayscale_q(nn.Module):
         self.relu4 = nn.ReLU()
         self.conv5 = nn.Conv2d(512, 1, kernel_size=3, stride=1, padding=0)
         self.relu5 = nn.ReLU()
-
-    def forward(self, x):
-        # Always use the fused path after quantization/fusion
-        x = self.conv1(x)
-        x = self.conv2(x)
-        x = self.conv3(x)
-        x = self.conv4(x)
-        x = self.conv5(x)
-        # Normalize between 0 and 1 only if not quantized
-        if not x.is_quantized:
-            x = x / torch.max(x)
-        return x
+        self.dequant = torch.quantization.DeQuantStub()
+
+    def forward(self, x, normalize=True):
+        # Once fused the ReLUs are Identity and the convs are ConvReLU2d, so the
+        # same forward works unfused (float), fused and quantized
+        x = self.quant(x)
+        x = self.relu1(self.conv1(x))
+        x = self.relu2(self.conv2(x))
+        x = self.relu3(self.conv3(x))
+        x = self.relu4(self.conv4(x))
+        x = self.relu5(self.conv5(x))
+        x = self.dequant(x)
+
+        # Normalized in float like the unquantized model
+        return normalize_peak(x) if normalize else x
     
     def fuse_model(self):
         # Fusing the model layers
@@ -97,6 +110,16 @@ class ImageReducer_bounded_grayscale_q(nn.Module):
                                                ['conv5', 'relu5']], inplace=True)
         return self
 
+    def prepare_static(self, engine):
+        # Fuse and insert the observers for post-training static quantization on
+        # the given engine ("x86"/"fbgemm" on the laptop, "qnnpack" on the Pi)
+        torch.backends.quantized.engine = engine
+        self.eval()
+        self.fuse_model()
+        self.qconfig = torch.quantization.get_default_qconfig(engine)
+        torch.quantization.prepare(self, inplace=True)
+        return self
+
 
 def get_model(arc):
     if arc == "ImageReducer":
@@ -1,5 +1,5 @@
 from PySide6.QtCore import Qt, QTimer
-from PySide6.QtGui import QPainter, QColor, QPen
+from PySide6.QtGui import QPainter, QColor, QPen, QPixmap, QFont
 from PySide6.QtWidgets import QWidget
 import random
 import math
@@ -10,6 +10,9 @@ class DepthWidget(QWidget):
         self.distance_to_surface = 0
         self.distance_to_seabed = 20
         self._test_mode = test_mode
+        self._sub_layer = None  # cached submarine pill, rebuilt on resize
+        self._label_font = QFont(self.font())
+        self._label_font.setPointSize(17)
         if self._test_mode:
             self._test_timer = QTimer(self)
             self._test_timer.timeout.connect(self._update_test)
@@ -24,13 +27,57 @@ class DepthWidget(QWidget):
         self.set_distances(d1, d2)
 
     def set_distances(self, distance_to_surface, distance_to_seabed):
+        # skip the repaint if the displayed values would not change
+        if (round(distance_to_surface, 1), round(distance_to_seabed, 1)) == (
+            round(self.distance_to_surface, 1), round(self.distance_to_seabed, 1)
+        ):
+            return
         self.distance_to_surface = distance_to_surface
         self.distance_to_seabed = distance_to_seabed
         self.update()
 
+    def resizeEvent(self, event):
+        self._sub_layer = None
+        super().resizeEvent(event)
+
+    def _render_sub_layer(self):
+        # The submarine stays in the middle of the water region, so it only
+        # depends on the widget size and is drawn once into a transparent layer.
+        w = self.width() / 2
+        h = self.height()
+        pill_width = 40
+        pill_height = 20
+        water_region_height = h - 60  # leave 30px for surface and seabed labels
+        sub_y = 30 + water_region_height / 2
+
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(self.size() * ratio)
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.Antialiasing)
+
+        # Draw the submarine (black pill) stationary in the middle
+        pill_x = (w / 2) - (pill_width / 2)
+        pill_y = sub_y - pill_height / 2
+        painter.setBrush(QColor(0, 0, 0))
+        painter.setPen(Qt.NoPen)
+        painter.drawRoundedRect(pill_x, pill_y, pill_width, pill_height, 10, 10)
+
+        # Draw the submarine label inside the pill
+        painter.setPen(Qt.white)
+        font = painter.font()
+        font.setPointSize(12)
+        painter.setFont(font)
+        painter.drawText(pill_x, pill_y, pill_width, pill_height, Qt.AlignCenter, "SUB")
+        painter.end()
+        return pixmap
+
     def paintEvent(self, event):
+        if self._sub_layer is None:
+            self._sub_layer = self._render_sub_layer()
+        # Everything drawn per frame is axis aligned, so no antialiasing is needed
         painter = QPainter(self)
-        painter.setRenderHint(QPainter.Antialiasing)
 
         # Widget geometry
         w = self.width() / 2
@@ -39,8 +86,6 @@ class DepthWidget(QWidget):
         # Heights for each region (proportional to distances)
         total_water = self.distance_to_surface + self.distance_to_seabed
         # Center the sub in the middle of the water region
-        pill_width = 40
-        pill_height = 20
         water_region_height = h - 60  # leave 30px for surface and seabed labels
         sub_y = 30 + water_region_height / 2
 
@@ -73,23 +118,11 @@ class DepthWidget(QWidget):
         painter.setPen(QPen(QColor(139, 69, 19), 2))
         painter.drawLine(0, seabed_y, w, seabed_y)
 
-        # Draw the submarine (black pill) stationary in the middle
-        pill_x = (w / 2) - (pill_width / 2)
-        pill_y = sub_y - pill_height / 2
-        painter.setBrush(QColor(0, 0, 0))
-        painter.setPen(Qt.NoPen)
-        painter.drawRoundedRect(pill_x, pill_y, pill_width, pill_height, 10, 10)
-
-        # Draw the submarine label inside the pill
-        painter.setPen(Qt.white)
-        font = painter.font()
-        font.setPointSize(12)
-        painter.setFont(font)
-        painter.drawText(pill_x, pill_y, pill_width, pill_height, Qt.AlignCenter, "SUB")
+        # Draw the submarine from the cached layer
+        painter.drawPixmap(0, 0, self._sub_layer)
 
         # Draw distance labels
         painter.setPen(Qt.black)
-        font.setPointSize(17)
-        painter.setFont(font)
+        painter.setFont(self._label_font)
         painter.drawText(0, 0, w, 30, Qt.AlignCenter, f"Surface: {self.distance_to_surface:.1f} m")
         painter.drawText(0, h - 30, w, 30, Qt.AlignCenter, f"Seabed: {self.distance_to_seabed:.1f} m")
@@ -13,9 +13,12 @@ class LEDIndicator(QWidget):
         
     def set_status(self, status=0):
         if status:
-            self.color = QColor(0, 255, 0)
+            color = QColor(0, 255, 0)
         else:
-            self.color = QColor(255, 0, 0)
+            color = QColor(255, 0, 0)
+        if color == self.color:
+            return
+        self.color = color
         self.update()
 
     def set_status_label(self, label):
@@ -1,5 +1,5 @@
 from PySide6.QtWidgets import QWidget, QApplication
-from PySide6.QtGui import QPainter, QPen, QColor
+from PySide6.QtGui import QPainter, QPen, QColor, QPixmap, QFont
 from PySide6.QtCore import Qt, QPointF
 import math
 import sys
@@ -9,13 +9,28 @@ class YawIndicator(QWidget):
         super().__init__(parent)
         self.yaw_angle = 0
         self.line_gap = 10
+        self._background = None  # cached dial, rebuilt on resize
+        self._text_font = QFont(self.font())
+        self._text_font.setBold(True)
+        self._text_font.setPointSize(self._text_font.pointSize() + 2)  # Increase the font size by 2 points
 
     def set_yaw_angle(self, angle):
+        # skip the repaint if the displayed value would not change
+        if round(angle, 1) == round(self.yaw_angle, 1):
+            return
         self.yaw_angle = angle
         self.update()
 
-    def paintEvent(self, event):
-        painter = QPainter(self)
+    def resizeEvent(self, event):
+        self._background = None
+        super().resizeEvent(event)
+
+    def _render_background(self):
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(self.size() * ratio)
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
         painter.setRenderHint(QPainter.Antialiasing)
 
         # Drawing circle
@@ -23,6 +38,17 @@ class YawIndicator(QWidget):
         center = QPointF((self.width() / 2), (self.height() / 2))
         painter.setPen(QPen(Qt.black, 2))
         painter.drawEllipse(center, radius, radius)
+        painter.end()
+        return pixmap
+
+    def paintEvent(self, event):
+        if self._background is None:
+            self._background = self._render_background()
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self._background)
+        painter.setRenderHint(QPainter.Antialiasing)
+
+        center = QPointF((self.width() / 2), (self.height() / 2))
 
         # Drawing arrow head
         painter.setPen(QPen(Qt.red, 3))
@@ -45,8 +71,5 @@ class YawIndicator(QWidget):
         text_rect = self.rect()
         text_rect.moveTop(text_rect.top() - 20)  # Adjust the offset as needed
         painter.setPen(Qt.black)
-        font = painter.font()
-        font.setBold(True)
-        font.setPointSize(font.pointSize() + 2)  # Increase the font size by 2 points
-        painter.setFont(font)
+        painter.setFont(self._text_font)
         painter.drawText(text_rect, Qt.AlignCenter, f"{self.yaw_angle:.1f}°")
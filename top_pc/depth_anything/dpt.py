@@ -100,7 +100,9 @@ class DPTHead(nn.Module):
                 nn.Identity(),
             )
             
-    def forward(self, out_features, patch_h, patch_w):
+    def forward(self, out_features, patch_h, patch_w, out_size=None):
+        # out_size: (h, w) the output convolutions run at instead of the input
+        # resolution (patch * 14), e.g. a reduced size or the obstacle grid
         out = []
         for i, x in enumerate(out_features):
             if self.use_clstoken:
@@ -130,7 +132,14 @@ class DPTHead(nn.Module):
         path_1 = self.scratch.refinenet1(path_2, layer_1_rn)
         
         out = self.scratch.output_conv1(path_1)
-        out = F.interpolate(out, (int(patch_h * 14), int(patch_w * 14)), mode="bilinear", align_corners=True)
+        if out_size is None:
+            out_size = (int(patch_h * 14), int(patch_w * 14))
+        if tuple(out_size) != tuple(out.shape[-2:]):
+            if out_size[0] <= out.shape[-2] and out_size[1] <= out.shape[-1]:
+                # averaging instead of bilinear sampling when going down
+                out = F.adaptive_avg_pool2d(out, out_size)
+            else:
+                out = F.interpolate(out, out_size, mode="bilinear", align_corners=True)
         out = self.scratch.output_conv2(out)
         
         return out
@@ -152,16 +161,27 @@ class DPT_DINOv2(nn.Module):
         
         self.depth_head = DPTHead(1, dim, features, use_bn, out_channels=out_channels, use_clstoken=use_clstoken)
         
-    def forward(self, x):
+    def forward(self, x, out_size=None, pool_to=None):
+        """
+        Args:
+            x: (B, 3, h, w) normalized images, h and w multiples of 14.
+            out_size: Optional (h, w) at which the head stops, skipping the upsampling
+                      and convolutions at full resolution. None returns an (h, w) map.
+            pool_to: Optional (grid_h, grid_w), average the head output down to that grid.
+        """
         h, w = x.shape[-2:]
         
         features = self.pretrained.get_intermediate_layers(x, 4, return_class_token=True)
         
         patch_h, patch_w = h // 14, w // 14
 
-        depth = self.depth_head(features, patch_h, patch_w)
-        depth = F.interpolate(depth, size=(h, w), mode="bilinear", align_corners=True)
+        depth = self.depth_head(features, patch_h, patch_w, out_size)
+        if out_size is None:
+            depth = F.interpolate(depth, size=(h, w), mode="bilinear", align_corners=True)
         depth = F.relu(depth)
+        if pool_to is not None:
+            # after the ReLU, so every cell is the mean of the map the full path returns
+            depth = F.adaptive_avg_pool2d(depth, pool_to)
 
         return depth.squeeze(1)
 
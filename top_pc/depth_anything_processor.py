@@ -4,12 +4,39 @@ from torchvision.transforms import Compose, Resize, ToTensor, Normalize
 from PIL import Image
 import numpy as np
 
-from depth_anything.dpt import DepthAnything
+from onnx_backend import OnnxModel, depth_onnx_path
+from model_store import load_depth_model
+from preprocess import DEPTH_INPUT_SIZE
+
+# with pool_to and no out_size, the head stops at this multiple of the grid
+# instead of running its last convolutions at full resolution
+POOL_HEAD_SCALE = 2
 
 class DepthAnythingProcessor:
-    def __init__(self, encoder='vitl', device='cuda'):
-        self.device = device
-        self.model = DepthAnything.from_pretrained(f'LiheYoung/depth_anything_{encoder}14').to(self.device).eval()
+    def __init__(self, encoder='vitl', device='cuda', backend="torch", onnx_path=None, out_size=None, graph=True,
+                 token_merge=0.0):
+        # backend "onnx" runs the graph exported by onnx_export.py with onnxruntime on the CPU
+        self.backend = backend
+        # out_size: (h, w) the DPT head stops at instead of the input resolution
+        self.out_size = out_size
+        if backend == "onnx":
+            if out_size is not None or token_merge:
+                raise ValueError("a reduced depth head output or token merging needs the torch backend")
+            self.device = "cpu"
+            self.model = OnnxModel(onnx_path or depth_onnx_path(encoder))
+        else:
+            # offline store written by model_store.py, falls back to the hub; the traced
+            # graph only has the full resolution path, pass graph=False for out_size/pool_to
+            self.device = device
+            self.model = load_depth_model(encoder, self.device, graph=graph and out_size is None and not token_merge)
+            # interpolate DINOv2's positional embeddings for our input size once, not every frame
+            pretrained = getattr(self.model, "pretrained", None)
+            if hasattr(pretrained, "precompute_pos_encoding"):
+                depth_w, depth_h = DEPTH_INPUT_SIZE
+                pretrained.precompute_pos_encoding([(depth_h, depth_w)])
+            if token_merge:
+                # merge similar patch tokens (open water) in the backbone, see set_token_merging
+                pretrained.set_token_merging(token_merge)
         self.transform = Compose([
             Resize((224, 224)),
             ToTensor(),
@@ -17,14 +44,130 @@ class DepthAnythingProcessor:
         ])
 
     def infer_pil(self, image):
+        return self.infer_batch([image])[0]
+
+    def infer_batch(self, images):
+        """Run one forward pass over several PIL images, returns one depth image each."""
+        depths = self.infer_depth(images)
+        # Convert to PIL images
+        return [Image.fromarray(depth.astype(np.uint8)) for depth in depths]
+
+    def infer_depth(self, images, as_tensor=False):
+        """
+        Run one forward pass over several PIL images and return float32 depth.
+
+        Each map is scaled to 0..255 like infer_pil, but without the 8-bit
+        quantization. Returns a (batch, h, w) NumPy array, or with as_tensor
+        the tensor on the model's device for further processing in torch.
+        """
         with torch.no_grad():
-            img = self.transform(image).unsqueeze(0).to(self.device)
-            depth = self.model(img)
-            depth = depth.squeeze().cpu().numpy()
-        
-        # Convert to PIL image
-        depth_pil = Image.fromarray((depth / depth.max() * 255).astype(np.uint8))
-        return depth_pil
+            batch = torch.stack([self.transform(image) for image in images]).to(self.device)
+        return self.infer_tensor(batch, as_tensor)
+
+    def infer_tensor(self, batch, as_tensor=False, pool_to=None):
+        """
+        Same as infer_depth for an already normalized (batch, 3, 224, 224) input tensor.
+
+        The maps are out_size, or (grid_h, grid_w) with pool_to, instead of 224x224.
+        With pool_to and no out_size the head stops at POOL_HEAD_SCALE times the grid.
+        """
+        if self.backend == "onnx":
+            if pool_to is not None:
+                raise ValueError("pool_to needs the torch backend")
+            depth = self.model(batch.cpu())
+            depth *= 255.0 / depth.max(axis=(1, 2), keepdims=True)
+            return torch.from_numpy(depth) if as_tensor else depth
+        out_size = self.out_size
+        if pool_to is not None and out_size is None:
+            out_size = (POOL_HEAD_SCALE * pool_to[0], POOL_HEAD_SCALE * pool_to[1])
+        with torch.inference_mode():
+            if out_size is None:
+                depth = self.model(batch)
+            else:
+                depth = self.model(batch, out_size=out_size, pool_to=pool_to)
+            depth = depth * (255.0 / depth.amax(dim=(1, 2), keepdim=True))
+        if as_tensor:
+            return depth
+        return depth.cpu().numpy()
 
     def __call__(self, image):
         return self.infer_pil(image)
+
+
+if __name__ == "__main__":
+    # Latency versus depth error of the cheaper depth paths (reduced head output,
+    # backbone token merging) against the full path, on recorded dives and
+    # compared on what the detector uses: the flipped depth averaged over every
+    # obstacle grid cell. With --reference vitb, vitb + token merging can be
+    # compared with plain vits against the full vitb depth.
+    import argparse
+    import time
+    import cv2
+    from preprocess import FramePreprocessor
+    from grid_pool import pool_grid
+
+    parser = argparse.ArgumentParser(description="Depth approximation benchmark")
+    parser.add_argument("videos", nargs="*", help="recorded dive videos or images")
+    parser.add_argument("--encoder", default="vits", choices=["vits", "vitb", "vitl"])
+    parser.add_argument("--reference", choices=["vits", "vitb", "vitl"], help="encoder of the reference depth (default: --encoder)")
+    parser.add_argument("--frames", type=int, default=50, help="frames taken from every video")
+    args = parser.parse_args()
+
+    grid_shape = (32, 32)  # RedSquaresGrid output for its 155x155 input
+    variants = [("112x112 head", (112, 112), None, 0.0), ("64x64 head", (64, 64), None, 0.0),
+                ("112x112 -> grid", (112, 112), grid_shape, 0.0), ("64x64 -> grid", (64, 64), grid_shape, 0.0),
+                ("grid head", grid_shape, None, 0.0),
+                ("merge 25%", None, None, 0.25), ("merge 50%", None, None, 0.5), ("merge 75%", None, None, 0.75)]
+
+    frames = []
+    for path in args.videos:
+        cap = cv2.VideoCapture(path)
+        taken = 0
+        while taken < args.frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(cv2.resize(frame, (640, 480)))
+            taken += 1
+        cap.release()
+    if not frames:
+        print("No input given, using synthetic frames (pass recorded dives for a meaningful check)")
+        rng = np.random.default_rng(0)
+        frames = [cv2.GaussianBlur(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8), (0, 0), 8) for _ in range(8)]
+
+    preprocessor = FramePreprocessor()
+
+    def cell_depths(depth):
+        flipped = depth.max() + depth.min() - depth
+        return pool_grid(flipped, grid_shape)["mean"]
+
+    def run(processor, out_size=None, pool_to=None, token_merge=0.0):
+        processor.out_size = out_size
+        processor.model.pretrained.set_token_merging(token_merge)
+        cells, elapsed = [], 0.0
+        for frame in frames:
+            depth_input = preprocessor.depth([frame])
+            start = time.perf_counter()
+            depth = processor.infer_tensor(depth_input, pool_to=pool_to)[0]
+            elapsed += time.perf_counter() - start
+            cells.append(cell_depths(depth))
+        return np.stack(cells), 1000 * elapsed / len(frames)
+
+    def report(name, cells, ms, reference, reference_ms):
+        error = np.abs(cells - reference)
+        correlation = np.mean([np.corrcoef(a.ravel(), b.ravel())[0, 1] for a, b in zip(cells, reference)])
+        print(f"{name:16s} {ms:7.1f} ms per frame ({reference_ms / ms:.2f}x), cell depth error mean {error.mean():5.2f} "
+              f"max {error.max():6.2f} (of 255), correlation {correlation:.4f}")
+
+    processor = DepthAnythingProcessor(encoder=args.encoder, device="cpu", graph=False)
+    full, full_ms = run(processor)
+    reference, reference_ms = full, full_ms
+    if args.reference and args.reference != args.encoder:
+        reference, reference_ms = run(DepthAnythingProcessor(encoder=args.reference, device="cpu", graph=False))
+        print(f"reference: {args.reference} full path, {reference_ms:.1f} ms per frame, {len(frames)} frames")
+        report(f"{args.encoder} full", full, full_ms, reference, reference_ms)
+    else:
+        print(f"reference: {args.encoder} full path, {full_ms:.1f} ms per frame, {len(frames)} frames")
+    for name, out_size, pool_to, token_merge in variants:
+        cells, ms = run(processor, out_size, pool_to, token_merge)
+        report(f"{args.encoder} {name}", cells, ms, reference, reference_ms)
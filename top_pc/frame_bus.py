@@ -0,0 +1,176 @@
+import hashlib
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+# Header layout (int64 words) at the start of the shared memory block:
+#   [0] magic  [1] height  [2] width  [3] channels  [4] slots  [5] write_seq
+#   [6] dtype character code, then one (seq, timestamp_ns) pair per slot
+# followed by `slots` frames of shape (height, width, channels), uint8 BGR by default.
+_MAGIC = 0x4242_4642_5553_0002  # "BBFBUS" v2
+_FIXED_WORDS = 7
+_FRAME_ALIGN = 64
+_WRITING = -1  # slot seq while the writer is filling it
+_created_here = set()  # buses owned by this process, already known to its resource tracker
+
+
+def frame_bus_name(url, stream="frames"):
+    """Shared memory name used for the frames decoded from a camera url.
+
+    Other per-camera streams (e.g. the obstacle maps computed from those
+    frames) pass their own stream name.
+    """
+    return f"bbc_{stream}_" + hashlib.md5(url.encode()).hexdigest()[:10]
+
+
+def _header_size(slots):
+    size = 8 * (_FIXED_WORDS + 2 * slots)
+    return (size + _FRAME_ALIGN - 1) // _FRAME_ALIGN * _FRAME_ALIGN
+
+
+class FrameBus:
+    """Ring of fixed-shape frames in shared memory, one writer, many readers.
+
+    The decoder creates the bus and publishes every frame once; the GUI, the
+    recorder or the obstacle detector attach to it by name and read the latest
+    (or the next) frame without pickling or decoding the stream again.
+    Each slot carries a sequence number so readers can tell when a frame they
+    hold a view of has been overwritten.
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        header = np.ndarray((_FIXED_WORDS,), dtype=np.int64, buffer=shm.buf)
+        if header[0] != _MAGIC:
+            raise ValueError(f"Shared memory {shm.name} is not a frame bus")
+        height, width, channels, slots = (int(v) for v in header[1:5])
+        self.shape = (height, width, channels)
+        self.slots = slots
+        self.dtype = np.dtype(chr(int(header[6])))
+        self._header = np.ndarray((_FIXED_WORDS + 2 * slots,), dtype=np.int64, buffer=shm.buf)
+        self._slot_seq = self._header[_FIXED_WORDS::2]
+        self._slot_time = self._header[_FIXED_WORDS + 1::2]
+        self.frames = np.ndarray(
+            (slots,) + self.shape, dtype=self.dtype, buffer=shm.buf, offset=_header_size(slots)
+        )
+
+    @classmethod
+    def create(cls, name, shape, slots=4, dtype=np.uint8):
+        """Create a new bus for frames of the given (height, width, channels) shape."""
+        height, width, channels = shape
+        dtype = np.dtype(dtype)
+        size = _header_size(slots) + slots * height * width * channels * dtype.itemsize
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # left over from a process that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((_FIXED_WORDS + 2 * slots,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[1:5] = (height, width, channels, slots)
+        header[6] = ord(dtype.char)
+        header[0] = _MAGIC
+        _created_here.add(shm._name)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to an existing bus, returns None if the writer has not created (or initialized) it yet."""
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # python < 3.13 has no track argument; stop the resource tracker from
+            # unlinking the writer's block when this process exits
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            except (FileNotFoundError, ValueError):
+                return None
+            if shm._name not in _created_here:
+                resource_tracker.unregister(shm._name, "shared_memory")
+        except (FileNotFoundError, ValueError):
+            # ValueError: the block exists but has not been sized yet
+            return None
+        # the writer sets the magic last, once the rest of the header is written
+        if shm.size < 8 * _FIXED_WORDS or np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0] != _MAGIC:
+            shm.close()
+            return None
+        return cls(shm, owner=False)
+
+    @property
+    def write_seq(self):
+        return int(self._header[5])
+
+    def publish(self, frame, timestamp_ns=None):
+        """Copy a frame into the next slot, returns its sequence number."""
+        seq = self.write_seq + 1
+        slot = seq % self.slots
+        self._slot_seq[slot] = _WRITING
+        self.frames[slot][...] = frame
+        self._slot_time[slot] = time.time_ns() if timestamp_ns is None else timestamp_ns
+        self._slot_seq[slot] = seq
+        self._header[5] = seq
+        return seq
+
+    def is_current(self, seq):
+        """True while the slot holding seq has not been reused by the writer."""
+        return int(self._slot_seq[seq % self.slots]) == seq
+
+    def _read(self, seq, copy):
+        slot = seq % self.slots
+        if int(self._slot_seq[slot]) != seq:
+            return None
+        timestamp_ns = int(self._slot_time[slot])
+        frame = self.frames[slot]
+        if copy:
+            frame = frame.copy()
+            if not self.is_current(seq):
+                return None
+        return seq, timestamp_ns, frame
+
+    def latest(self, copy=True):
+        """Return (seq, timestamp_ns, frame) for the newest frame, or None.
+
+        With copy=False the frame is a view into shared memory; check
+        is_current(seq) after using it to make sure it was not overwritten.
+        """
+        for _ in range(self.slots):
+            seq = self.write_seq
+            if seq == 0:
+                return None
+            result = self._read(seq, copy)
+            if result is not None:
+                return result
+        return None
+
+    def next(self, after_seq, timeout=1.0, copy=True):
+        """Wait for the frame following after_seq, returns None on timeout.
+
+        If the reader fell so far behind that the frame was already overwritten,
+        the latest frame is returned instead; the gap in seq tells how many
+        frames were skipped.
+        """
+        deadline = time.monotonic() + timeout
+        while self.write_seq <= after_seq:
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(0.001)
+        result = self._read(after_seq + 1, copy)
+        if result is None:
+            result = self.latest(copy)
+        return result
+
+    def close(self):
+        self.frames = None
+        self._header = self._slot_seq = self._slot_time = None
+        self.shm.close()
+        if self.owner:
+            _created_here.discard(self.shm._name)
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -1,41 +1,132 @@
+import os
+import json
+
 import torch
 import numpy as np
 from PIL import Image
-from avoid_net import get_model
+from avoid_net import normalize_peak, NORMALIZED_ARCS
+from model_store import load_grid_model
 from dataset import SUIMGrayscaleTransformOnly
 from draw_obsticle import draw_red_squares
+from onnx_backend import OnnxModel, grid_onnx_path, GRID_NORMALIZATION_KEY, GRID_NORMALIZATION, GRID_PEAK_OUTPUT
+from quantize_grid import load_quantized
+
+
+def peak_level_path(arc, run_name):
+    """Where the calibrated peak level of a run is saved, next to its .pth."""
+    return f"models/{arc}_{run_name}_peak_level.json"
+
 
 class RedSquaresGrid:
-    def __init__(self, arc, run_name, use_gpu=False, que=False, threshold=0.5):
-        if que:
-            model = get_model(arc + '_q')
+    def __init__(self, arc, run_name, use_gpu=False, que=False, threshold=0.5, backend="torch", onnx_path=None):
+        # backend "onnx" runs the graph exported by onnx_export.py with onnxruntime on the CPU
+        self.backend = backend
+        if backend == "onnx":
+            self.model = OnnxModel(onnx_path or grid_onnx_path(arc, run_name))
+            if (self.model.metadata.get(GRID_NORMALIZATION_KEY) != GRID_NORMALIZATION
+                    or GRID_PEAK_OUTPUT not in self.model.output_names):
+                # older exports normalize over the whole batch, coupling the cameras of a batch
+                raise RuntimeError(f"{self.model.path} predates the per-sample grid normalization, "
+                                   f"export it again with onnx_export.py")
+            self.device = torch.device("cpu")
+        elif que:
+            # int8 weights written by quantize_grid.py, quantized models only run on the CPU
+            self.model = load_quantized(arc, run_name)
+            self.device = torch.device("cpu")
         else:
-            model = get_model(arc)
-        device = torch.device("cuda" if torch.cuda.is_available() and use_gpu else "cpu")
-        model.load_state_dict(torch.load(f"models/{arc}_{run_name}.pth", map_location=device))
-        model.to(device).eval()
-        self.model = model
-        self.device = device
+            device = torch.device("cuda" if torch.cuda.is_available() and use_gpu else "cpu")
+            self.model = load_grid_model(arc, run_name, device)
+            self.device = device
         dataset = SUIMGrayscaleTransformOnly()
         self.image_transform = dataset.get_transform()
         self.threshold = threshold
+        self.normalized = arc in NORMALIZED_ARCS
+        # raw activation peak below which a frame has no obstacle, see calibrate_peak_level
+        self.peak_level = None
+        if os.path.exists(peak_level_path(arc, run_name)):
+            with open(peak_level_path(arc, run_name)) as f:
+                self.peak_level = json.load(f)["level"]
 
     def __call__(self, frame):
         # frame: numpy array (H, W, C)
-        frame_tensor = Image.fromarray(frame)
-        frame_tensor = self.image_transform(frame_tensor).to(self.device).unsqueeze(0)
-        outputs = self.model(frame_tensor)
-        outputs = outputs.detach().cpu()[0].permute(1, 2, 0)
-        outputs = np.array(outputs)
+        return self.batch([frame])[0]
+
+    def batch(self, frames):
+        # frames: list of numpy arrays (H, W, C), run through the model in one forward pass
+        frame_tensor = torch.stack([self.image_transform(Image.fromarray(frame)) for frame in frames]).to(self.device)
         # frame_with_squares = draw_red_squares(frame, outputs, self.threshold)
-        return outputs
+        return self.batch_tensor(frame_tensor)
+
+    def batch_tensor(self, frame_tensor, with_peak=False):
+        # frame_tensor: already normalized (B, 1, 155, 155) input, e.g. from FramePreprocessor
+        # with_peak also returns the (B,) peak of the raw activation, which unlike the
+        # normalized grid (whose peak is always 1) tells whether anything is there at all
+        if self.backend == "onnx":
+            outputs, peaks = self.model.run(frame_tensor.cpu(), ["output", GRID_PEAK_OUTPUT])
+            outputs = outputs.transpose(0, 2, 3, 1)
+            return (outputs, peaks) if with_peak else outputs
+        with torch.inference_mode():
+            # no-op unless the input was prepared on another device (int8 runs on the CPU)
+            frame_tensor = frame_tensor.to(self.device)
+            if not with_peak:
+                return self.model(frame_tensor).cpu().permute(0, 2, 3, 1).numpy()
+            raw = self.model(frame_tensor, normalize=False) if self.normalized else self.model(frame_tensor)
+            outputs = normalize_peak(raw) if self.normalized else raw
+            peaks = raw.amax(dim=(1, 2, 3))
+        return outputs.cpu().permute(0, 2, 3, 1).numpy(), peaks.cpu().numpy()
+
+
+def calibrate_peak_level(grid, loader, recall=0.99):
+    """
+    Raw activation peak level above which a frame is treated as having obstacles.
+
+    Chosen so that `recall` of the images with at least one obstacle cell in their
+    mask are still above it.
+
+    Args:
+        grid (RedSquaresGrid): The model to calibrate, on the backend it will run on.
+        loader (DataLoader): SUIM_grayscale images with their grided masks.
+        recall (float): Fraction of the obstacle images that must stay above the level.
+
+    Returns:
+        dict: level, recall, and the fraction of the clear images that fall below it (skipped).
+    """
+    obstacle_peaks, clear_peaks = [], []
+    for images, masks in loader:
+        _, peaks = grid.batch_tensor(images, with_peak=True)
+        has_obstacle = (masks.flatten(1) > 0.5).any(dim=1).numpy()
+        obstacle_peaks.extend(peaks[has_obstacle])
+        clear_peaks.extend(peaks[~has_obstacle])
+    level = float(np.quantile(obstacle_peaks, 1.0 - recall))
+    skipped = float(np.mean(np.asarray(clear_peaks) < level)) if clear_peaks else float("nan")
+    return {"level": level, "recall": recall, "clear_skipped": skipped,
+            "obstacle_images": len(obstacle_peaks), "clear_images": len(clear_peaks)}
 
 
 # example usage:
-# red_squares_grid = RedSquaresGrid("ImageReducer_bounded_grayscale", "run_2", use_gpu=True, que=True)
+# red_squares_grid = RedSquaresGrid("ImageReducer_bounded_grayscale", "run_2", use_gpu=False, que=True)  # int8, see quantize_grid.py
 # frame = np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)
 # output = red_squares_grid(frame)
 # print("Output shape:", output.shape)
 # print("Output type:", output.dtype)
 # print("Output min:", output.min())
-# print("Output max:", output.max())
\ No newline at end of file
+# print("Output max:", output.max())
+
+if __name__ == "__main__":
+    import argparse
+    from torch.utils.data import DataLoader
+    from dataset import SUIM_grayscale
+
+    parser = argparse.ArgumentParser(description="Calibrate the peak level the cascade uses to skip clear frames")
+    parser.add_argument("data", help="SUIM dataset directory (with images/ and the grided masks)")
+    parser.add_argument("--arc", default="ImageReducer_bounded_grayscale")
+    parser.add_argument("--run-name", default="run_2")
+    parser.add_argument("--recall", type=float, default=0.99, help="fraction of obstacle images that keep their depth")
+    args = parser.parse_args()
+
+    grid = RedSquaresGrid(args.arc, args.run_name)
+    report = calibrate_peak_level(grid, DataLoader(SUIM_grayscale(args.data), batch_size=16), args.recall)
+    with open(peak_level_path(args.arc, args.run_name), "w") as f:
+        json.dump(report, f)
+    print(f"Peak level {report['level']:.4f}: {100 * report['recall']:.0f}% of {report['obstacle_images']} obstacle "
+          f"images above it, {100 * report['clear_skipped']:.1f}% of {report['clear_images']} clear images skipped")
\ No newline at end of file
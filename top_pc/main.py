@@ -11,11 +11,11 @@ from PySide6.QtCore import QTimer
 from main_window import MainWindow
 import configparser
 
-from parse_data import SensorDataParser
-parser = SensorDataParser()
+from parse_data import TELEMETRY_BINARY_REQUEST, TELEMETRY_TEXT_REQUEST
+from telemetry_buffer import TelemetryRingBuffer, TelemetryReceiver
 
 from recorder import DataLogger
-from opencv_communicator import opencv_communicator
+from opencv_communicator import opencv_communicator, obstacle_service_communicator
 
 class BigBoyControl:
     def __init__(self):
@@ -29,10 +29,12 @@ class BigBoyControl:
         self.record_flag = False
         self.recorder = DataLogger()
         self.video_feed = []
+        self.obstacle_service = None  # shared obstacle detector for all feeds
         self.teensy_address = None
         self.new_devices = {}
         self.pi_exist = False
         self.device_last_seen = {}  # Track when devices were last seen
+        self.binary_telemetry = True  # ask the Teensy for binary telemetry frames, text is the fallback
 
         self.camera_urls = [5000, 5001]
 
@@ -42,6 +44,16 @@ class BigBoyControl:
         self.sock.settimeout(1.0)  # Add timeout for non-blocking operations
         self.devices = {}  # Dictionary to store IP and device names
 
+        # Telemetry samples land in a ring buffer that the GUI and recorder read from
+        self.telemetry = TelemetryRingBuffer()
+        self.record_cursor = 0
+        self.telemetry_sources = set()  # addresses telemetry has been received from
+        self.display_rate_hz = 30  # how often the gauges are refreshed from the latest sample
+        self.displayed_count = 0
+        self.receiver = TelemetryReceiver(
+            self.sock, self.telemetry, on_packet=self.handle_packet, on_telemetry=self.handle_telemetry
+        )
+
     def parse_sensor_data(self, data):
         # Split the data into lines
         lines = data.split('\n')[1:]  # Skip the first line
@@ -73,6 +85,7 @@ class BigBoyControl:
                 self.window.network_status.set_device_status(device_name, addr[0], True)
             if device_name == "Teensy":
                 self.teensy_address = addr[0]
+                self.negotiate_telemetry_format()
             elif device_name == "RPi":
                 self.check_pi()
             return self.devices
@@ -85,37 +98,69 @@ class BigBoyControl:
                 print(f"Error sending broadcast: {e}")
         return self.devices
 
+    def negotiate_telemetry_format(self):
+        # Repeated on every handshake until binary frames arrive, so a Teensy that
+        # rebooted (and fell back to text) gets asked again. Old firmware ignores it.
+        if self.binary_telemetry == self.receiver.last_binary:
+            return
+        request = TELEMETRY_BINARY_REQUEST if self.binary_telemetry else TELEMETRY_TEXT_REQUEST
+        try:
+            self.sock.sendto(request, (self.teensy_address, self.PORT))
+        except Exception as e:
+            print(f"Error sending telemetry format request: {e}")
+
     def listen_to_data(self):
-        # Listen for data from devices
+        # Listen for data from devices, every pending packet is drained per wakeup
         while True:
             try:
-                data, addr = self.sock.recvfrom(1024)
-                # Update last seen time for this device
-                self.device_last_seen[addr[0]] = time.time()
-                
-                # if data starts with "I am", then it is a device name
-                if data.decode().startswith("I am"):
-                    device_name = data.decode().split("I am ")[1]
-                    self.get_devices(device_name, addr)
-                elif data.decode().startswith("data"):
-                    data = parser(data.decode())
-                    # Update device status as active since we received data
-                    if addr[0] in self.devices and self.window and hasattr(self.window, 'network_status'):
-                        self.window.network_status.set_device_status(self.devices[addr[0]], addr[0], True)
-                    # if record flag is true, then log the data
-                    if self.record_flag:
-                        self.recorder.log_data(data)
-                    # send data to update gauge
-                    self.update_gauges(data)
-                elif data.decode().startswith("message"):
-                    # send message to the message log
-                    pass
-            except socket.timeout:
-                continue
+                self.receiver.run()
             except Exception as e:
                 print(f"Error in listen_to_data: {e}")
                 time.sleep(0.1)
 
+    def handle_packet(self, packet, addr):
+        # Non-telemetry packets (handshakes and messages)
+        self.device_last_seen[addr[0]] = time.time()
+        try:
+            text = packet.decode()
+        except UnicodeDecodeError:
+            return
+        # if data starts with "I am", then it is a device name
+        if text.startswith("I am"):
+            device_name = text.split("I am ")[1]
+            self.get_devices(device_name, addr)
+        elif text.startswith("message"):
+            # send message to the message log
+            pass
+
+    def handle_telemetry(self, addresses):
+        # Called once per drained batch, after the new samples are in self.telemetry.
+        # Runs on the listener thread, so no widgets are touched here; the display
+        # timer picks the latest sample up (see refresh_display).
+        now = time.time()
+        for address in addresses:
+            self.device_last_seen[address] = now
+            self.telemetry_sources.add(address)
+        # if record flag is true, then log every sample received since the last batch
+        if self.record_flag:
+            samples, self.record_cursor = self.telemetry.read_since(self.record_cursor)
+            for sample in samples:
+                data = self.telemetry.to_dict(sample)
+                self.recorder.log_data(data, timestamp=data["hostTime"])
+
+    def refresh_display(self):
+        # Runs on the Qt thread at display_rate_hz, only the newest sample is shown
+        if self.telemetry.count == self.displayed_count:
+            return
+        self.displayed_count = self.telemetry.count
+        self.update_gauges(self.telemetry.latest())
+        # Update device status as active since we received data
+        network_status = self.window.network_status
+        for address in list(self.telemetry_sources):
+            device_name = self.devices.get(address)
+            if device_name and network_status.devices.get(device_name) is not True:
+                network_status.set_device_status(device_name, address, True)
+
     def input_stream(self):
         controller = Controller()
         controller_status = controller.active
@@ -177,6 +222,7 @@ class BigBoyControl:
                     if device_name == "RPi" and self.pi_exist:
                         self.pi_exist = False
                         # Stop video feeds
+                        self.stop_obstacle_service()
                         for feed in self.video_feed:
                             feed.stop_opencv()
                         self.video_feed.clear()
@@ -193,6 +239,9 @@ class BigBoyControl:
                 self.pi_exist = True
                 for feed in self.video_feed:
                     feed.start_opencv()
+                # start the shared obstacle service paused, it loads the models in the
+                # background so enabling obstacle avoidance later does not wait for them
+                self.start_obstacle_service()
                 # Only set Camera Feed status to True if at least one feed is running
                 camera_feed_running = any(feed.running for feed in self.video_feed)
                 if self.window and hasattr(self.window, 'network_status'):
@@ -208,6 +257,7 @@ class BigBoyControl:
         self.record_flag = not self.record_flag
         self.window.network_status.set_record_status(self.record_flag)
         if self.record_flag:
+            self.record_cursor = self.telemetry.count
             self.recorder.start_recording(self.video_feed)
         else:
             self.recorder.stop_recording()
@@ -218,11 +268,17 @@ class BigBoyControl:
                 print("Obstacle avoidance enabled")
                 # send video frames to the obstacle avoidance logic
                 if self.pi_exist:
-                    for feed in self.video_feed:
-                        if getattr(feed, "running", False):
-                            feed.start_obstacle_avoidance()
-                        else:
-                            print("Skipping obstacle avoidance for feed: not running")
+                    running_feeds = [feed for feed in self.video_feed if getattr(feed, "running", False)]
+                    if len(running_feeds) < len(self.video_feed):
+                        print("Skipping obstacle avoidance for feeds that are not running")
+                    # one service runs the models for all cameras in a single batch,
+                    # started when the Pi connected (again here if it failed or exited)
+                    if running_feeds and (self.obstacle_service is None or not self.obstacle_service.is_alive()):
+                        self.start_obstacle_service()
+                    if self.obstacle_service is not None:
+                        self.obstacle_service.resume()
+                    for feed in running_feeds:
+                        feed.start_obstacle_avoidance(shared=True)
             else:
                 print("Obstacle avoidance disabled")
                 # Stop obstacle avoidance logic
@@ -232,6 +288,21 @@ class BigBoyControl:
                             feed.stop_obstacle_avoidance()
                         else:
                             print("Skipping obstacle avoidance stop for feed: not running")
+                # keep the models loaded, only stop processing frames
+                if self.obstacle_service is not None:
+                    self.obstacle_service.pause()
+
+    def start_obstacle_service(self):
+        self.stop_obstacle_service()
+        running_feeds = [feed for feed in self.video_feed if getattr(feed, "running", False)]
+        if running_feeds:
+            self.obstacle_service = obstacle_service_communicator([feed.url for feed in running_feeds], paused=True)
+            self.obstacle_service.start_service()
+
+    def stop_obstacle_service(self):
+        if self.obstacle_service is not None:
+            self.obstacle_service.stop_service()
+            self.obstacle_service = None
 
     def run(self):
         # run the GUI
@@ -259,6 +330,11 @@ class BigBoyControl:
         input_stream = threading.Thread(target=self.input_stream, daemon=True)
         input_stream.start()
         
+        # push the latest telemetry to the gauges at a fixed display rate
+        self.display_timer = QTimer()
+        self.display_timer.timeout.connect(self.refresh_display)
+        self.display_timer.start(int(1000 / self.display_rate_hz))
+
         # keep the GUI alive (temporary solution)
         self.timer = QTimer()
         self.timer.timeout.connect(self.keep_alive)
@@ -297,4 +373,5 @@ if __name__ == "__main__":
     # Update the instance variables
     main_frame = BigBoyControl()
     main_frame.camera_urls = ["video_feed_1", "video_feed_2"]
+    main_frame.display_rate_hz = config.getint("Display", "DISPLAY_RATE_HZ", fallback=30)
     main_frame.run()
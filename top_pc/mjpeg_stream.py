@@ -0,0 +1,198 @@
+import threading
+import time
+import urllib.request
+
+import cv2
+import numpy as np
+
+JPEG_EOI = b"\xff\xd9"
+
+
+class MJPEGStream:
+    """Client for a multipart/x-mixed-replace MJPEG stream with latest-frame semantics.
+
+    A background thread keeps one persistent HTTP connection open, splits the
+    stream on the multipart boundaries and keeps only the newest JPEG. Frames
+    are decoded only when read() is called, so JPEGs that arrive while the
+    consumer is busy are dropped instead of queued. The connection is
+    re-opened with exponential backoff whenever it fails.
+    """
+
+    def __init__(self, url, connect_timeout=5.0, min_backoff=0.5, max_backoff=8.0, chunk_size=65536):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.chunk_size = chunk_size
+
+        self.connected = False
+        self._running = False
+        self._thread = None
+        self._response = None
+        self._cond = threading.Condition()
+        self._jpeg = None
+        self._jpeg_seq = 0  # number of JPEGs received
+        self._read_seq = 0  # seq of the last JPEG handed to read()
+
+        # counters, see stats()
+        self.bytes_received = 0
+        self.frames_decoded = 0
+        self.frames_dropped = 0
+        self.decode_failures = 0
+        self.decode_time = 0.0
+        self.reconnects = 0
+        self._last_stats = (time.monotonic(), 0, 0)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._running = True
+            self._thread = threading.Thread(target=self._receive_loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def release(self):
+        self._running = False
+        response = self._response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+        with self._cond:
+            self._cond.notify_all()
+
+    def read(self, timeout=0.1):
+        """Decode and return the newest JPEG as (True, frame).
+
+        Returns (False, None) if no new JPEG arrived within timeout.
+        """
+        with self._cond:
+            if self._jpeg_seq == self._read_seq:
+                self._cond.wait(timeout)
+            if self._jpeg_seq == self._read_seq:
+                return False, None
+            jpeg = self._jpeg
+            self._read_seq = self._jpeg_seq
+
+        start = time.perf_counter()
+        frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        self.decode_time += time.perf_counter() - start
+        if frame is None:
+            self.decode_failures += 1
+            return False, None
+        self.frames_decoded += 1
+        return True, frame
+
+    def stats(self):
+        """Rates since the previous call plus the running counters."""
+        now = time.monotonic()
+        last_time, last_bytes, last_frames = self._last_stats
+        elapsed = max(now - last_time, 1e-6)
+        received = self._jpeg_seq
+        self._last_stats = (now, self.bytes_received, received)
+        return {
+            "connected": self.connected,
+            "bytes_per_s": (self.bytes_received - last_bytes) / elapsed,
+            "frames_per_s": (received - last_frames) / elapsed,
+            "frames_received": received,
+            "frames_decoded": self.frames_decoded,
+            "frames_dropped": self.frames_dropped,
+            "decode_failures": self.decode_failures,
+            "decode_ms": 1000 * self.decode_time / max(self.frames_decoded, 1),
+            "reconnects": self.reconnects,
+        }
+
+    def _publish(self, jpeg):
+        with self._cond:
+            if self._jpeg_seq != self._read_seq:
+                self.frames_dropped += 1  # previous JPEG was never read
+            self._jpeg = jpeg
+            self._jpeg_seq += 1
+            self._cond.notify_all()
+
+    def _receive_loop(self):
+        backoff = self.min_backoff
+        while self._running:
+            try:
+                self._response = urllib.request.urlopen(self.url, timeout=self.connect_timeout)
+                boundary = self._boundary(self._response.headers.get("Content-Type", ""))
+                self.connected = True
+                backoff = self.min_backoff
+                print(f"MJPEG stream connected: {self.url}", flush=True)
+                self._read_parts(self._response, boundary)
+            except Exception as e:
+                if self._running:
+                    print(f"MJPEG stream error ({self.url}): {e}, retrying in {backoff:.1f}s", flush=True)
+            finally:
+                self.connected = False
+                if self._response is not None:
+                    try:
+                        self._response.close()
+                    except Exception:
+                        pass
+                    self._response = None
+            if not self._running:
+                break
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+            self.reconnects += 1
+
+    @staticmethod
+    def _boundary(content_type):
+        for param in content_type.split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "boundary":
+                value = value.strip('"')
+                if value.startswith("--"):
+                    value = value[2:]
+                return b"--" + value.encode()
+        raise ValueError(f"Not a multipart stream: {content_type!r}")
+
+    def _read_parts(self, response, boundary):
+        buf = bytearray()
+        while self._running:
+            chunk = response.read1(self.chunk_size)
+            if not chunk:
+                raise ConnectionError("stream closed by server")
+            self.bytes_received += len(chunk)
+            buf += chunk
+            # handle every complete part in the buffer, keep the remainder
+            while True:
+                consumed = self._extract_part(buf, boundary)
+                if consumed == 0:
+                    break
+                del buf[:consumed]
+
+    def _extract_part(self, buf, boundary):
+        """Publish the first complete part in buf, returns the bytes consumed (0 if incomplete)."""
+        start = buf.find(boundary)
+        if start < 0:
+            # keep a tail in case a boundary is split across chunks
+            return max(len(buf) - len(boundary), 0)
+        header_end = buf.find(b"\r\n\r\n", start)
+        if header_end < 0:
+            return start
+        body_start = header_end + 4
+
+        content_length = None
+        for line in bytes(buf[start + len(boundary):header_end]).split(b"\r\n"):
+            key, _, value = line.partition(b":")
+            if key.strip().lower() == b"content-length":
+                content_length = int(value)
+        if content_length is not None:
+            body_end = body_start + content_length
+            if len(buf) < body_end:
+                return start
+        else:
+            # the JPEG end-of-image marker cannot appear inside entropy coded data,
+            # so the frame can be published without waiting for the next boundary
+            eoi = buf.find(JPEG_EOI, body_start)
+            if eoi < 0:
+                return start
+            body_end = eoi + len(JPEG_EOI)
+
+        self._publish(bytes(buf[body_start:body_end]))
+        return body_end
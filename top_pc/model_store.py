@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import argparse
+
+import torch
+
+from avoid_net import get_model
+from preprocess import DEPTH_INPUT_SIZE
+
+# Offline copies of the detector models, written once by this script (the
+# only step that needs the network) and loaded without the Hugging Face hub:
+#  - <name>.safetensors  weights, memory mapped on load instead of unpickled
+#  - <name>.json         constructor config of the model
+#  - <name>.ts           optional traced TorchScript graph at the fixed input size,
+#                        loads without building the model in Python at all
+STORE_DIR = os.path.join("models", "store")
+
+
+def depth_store_name(encoder):
+    return f"depth_anything_{encoder}14"
+
+
+def grid_store_name(arc, run_name):
+    return f"{arc}_{run_name}"
+
+
+def _store_path(name, ext):
+    return os.path.join(STORE_DIR, name + ext)
+
+
+def save_weights(model, name, config=None):
+    from safetensors.torch import save_file
+
+    os.makedirs(STORE_DIR, exist_ok=True)
+    state = {key: value.detach().cpu().contiguous() for key, value in model.state_dict().items()}
+    save_file(state, _store_path(name, ".safetensors"))
+    with open(_store_path(name, ".json"), "w") as f:
+        json.dump(config or {}, f)
+
+
+def save_graph(model, name, example):
+    """Trace the model at the example's input size and save the TorchScript graph."""
+    os.makedirs(STORE_DIR, exist_ok=True)
+    with torch.inference_mode():
+        graph = torch.jit.trace(model.eval(), example)
+    graph.save(_store_path(name, ".ts"))
+    return graph
+
+
+def _load_weights(build, name, device):
+    # build the module on the meta device (no random init), then assign the
+    # memory mapped safetensors tensors to it
+    from safetensors.torch import load_file
+
+    with open(_store_path(name, ".json")) as f:
+        config = json.load(f)
+    with torch.device("meta"):
+        model = build(config)
+    model.load_state_dict(load_file(_store_path(name, ".safetensors")), assign=True)
+    if any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+        raise RuntimeError(f"{name}: the store does not cover every tensor of the model")
+    return model.to(device).eval()
+
+
+def _load(build, name, device, graph):
+    if graph and os.path.exists(_store_path(name, ".ts")):
+        return torch.jit.load(_store_path(name, ".ts"), map_location=device).eval()
+    if os.path.exists(_store_path(name, ".safetensors")):
+        return _load_weights(build, name, device)
+    return None
+
+
+def _build_depth(config):
+    from depth_anything.dpt import DepthAnything
+    return DepthAnything(config)
+
+
+def load_depth_model(encoder, device, graph=True):
+    """
+    Depth Anything from the store, or from the Hugging Face hub when it has not been stored.
+
+    Args:
+        encoder (str): 'vits', 'vitb' or 'vitl'.
+        device (str): Device to load the model on.
+        graph (bool): Prefer the TorchScript graph, which only runs at DEPTH_INPUT_SIZE.
+    """
+    model = _load(_build_depth, depth_store_name(encoder), device, graph)
+    if model is not None:
+        return model
+    print(f"model_store: {depth_store_name(encoder)} not stored, loading it from the hub", flush=True)
+    from depth_anything.dpt import DepthAnything
+    return DepthAnything.from_pretrained(f'LiheYoung/depth_anything_{encoder}14').to(device).eval()
+
+
+def load_grid_model(arc, run_name, device):
+    """An avoid_net model from the store, or from its models/*.pth checkpoint."""
+    model = _load(lambda config: get_model(arc), grid_store_name(arc, run_name), device, graph=False)
+    if model is not None:
+        return model
+    model = get_model(arc)
+    model.load_state_dict(torch.load(f"models/{arc}_{run_name}.pth", map_location=device))
+    return model.to(device).eval()
+
+
+def store_depth(encoder, graph=True):
+    from huggingface_hub import hf_hub_download
+    from depth_anything.dpt import DepthAnything
+
+    repo = f'LiheYoung/depth_anything_{encoder}14'
+    with open(hf_hub_download(repo, "config.json")) as f:
+        config = json.load(f)
+    model = DepthAnything.from_pretrained(repo).eval()
+    name = depth_store_name(encoder)
+    save_weights(model, name, config)
+    if graph:
+        depth_w, depth_h = DEPTH_INPUT_SIZE
+        save_graph(model, name, torch.randn(2, 3, depth_h, depth_w))
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the offline model store used by the obstacle detector")
+    parser.add_argument("--encoders", nargs="*", default=["vits"], choices=["vits", "vitb", "vitl"])
+    parser.add_argument("--arc", default="ImageReducer_bounded_grayscale")
+    parser.add_argument("--run-name", default="run_2")
+    parser.add_argument("--no-graph", action="store_true", help="store only the weights, no TorchScript graph")
+    args = parser.parse_args()
+
+    depth_w, depth_h = DEPTH_INPUT_SIZE
+    example = torch.randn(1, 3, depth_h, depth_w)
+    for encoder in args.encoders:
+        reference = store_depth(encoder, graph=not args.no_graph)
+        with torch.inference_mode():
+            expected = reference(example)
+            for graph in ([False] if args.no_graph else [False, True]):
+                start = time.perf_counter()
+                model = load_depth_model(encoder, "cpu", graph=graph)
+                load_time = time.perf_counter() - start
+                difference = float((model(example) - expected).abs().max())
+                print(f"{depth_store_name(encoder)} ({'graph' if graph else 'weights'}): "
+                      f"loads in {1000 * load_time:.0f} ms, max difference {difference:.2e}", flush=True)
+
+    model = load_grid_model(args.arc, args.run_name, "cpu")
+    save_weights(model, grid_store_name(args.arc, args.run_name))
+    print(f"Stored {grid_store_name(args.arc, args.run_name)}", flush=True)
@@ -1,11 +1,14 @@
 import torch
-from PIL import Image
 import cv2
 import numpy as np
 
 # --- Model and Device Setup ---
 from depth_anything_processor import DepthAnythingProcessor
 from frame_red_squares import RedSquaresGrid
+from preprocess import FramePreprocessor
+from grid_pool import pool_grid, cell_centers
+from temporal_depth import TemporalDepth
+from obstacle_overlay import ObstacleOverlay
 
 import matplotlib
 # <<< CHANGE 1: Import the main matplotlib library to set the backend
@@ -14,9 +17,36 @@ matplotlib.use('Agg') # Use a non-interactive backend
 import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
 from mpl_toolkits.mplot3d import Axes3D  # noqa: F401
+import sys
+import time
+import threading
+
+class ObstacleResult:
+    """
+    Everything one detector pass computed for a frame, so visualizers and other
+    consumers never have to run the models again.
+
+    Attributes:
+        frame (np.ndarray): The frame resized to the detector's target size, BGR.
+        depth (np.ndarray): The full flipped float32 depth map at the depth model's output size,
+            None when cascade mode skipped depth inference for the frame.
+        obstacle_probs (np.ndarray): The raw (grid_h, grid_w, channels) grid model output.
+        obstacle_depth_map (np.ndarray): Pooled depth of every obstacle cell, np.nan elsewhere.
+        timings (dict): Seconds spent per stage; stages run once per batch, see 'batch_size'.
+    """
+
+    def __init__(self, frame, depth, obstacle_probs, obstacle_depth_map, timings):
+        self.frame = frame
+        self.depth = depth
+        self.obstacle_probs = obstacle_probs
+        self.obstacle_depth_map = obstacle_depth_map
+        self.timings = timings
 
 class ObstacleDetector:
-    def __init__(self, encoder='vits', red_squares_arc="ImageReducer_bounded_grayscale", red_squares_run_name="run_2", use_gpu=True):
+    def __init__(self, encoder='vits', red_squares_arc="ImageReducer_bounded_grayscale", red_squares_run_name="run_2", use_gpu=True,
+                 cascade=False, cascade_crop=False, cascade_level=None, pool_stat="mean", pool_percentile=10,
+                 temporal=None, temporal_threshold=0.04, max_staleness=10, backend="torch",
+                 red_squares_int8=False, depth_out_size=None, depth_to_grid=False, token_merge=0.0):
         """
         Initializes the obstacle detection system.
 
@@ -25,22 +55,87 @@ class ObstacleDetector:
             red_squares_arc (str): The architecture for the RedSquaresGrid model.
             red_squares_run_name (str): The run name for the RedSquaresGrid model.
             use_gpu (bool): Whether to use GPU if available.
+            cascade (bool): Run the cheap grid model first and skip depth inference on
+                            frames whose raw grid activation peaks below cascade_level.
+            cascade_crop (bool): In cascade mode, run depth only on a crop around the flagged cells.
+            cascade_level (float): Raw activation peak of a frame with obstacles, defaults to the
+                                   level calibrated with frame_red_squares.py for the grid model.
+            pool_stat (str): How the depth of an obstacle cell is pooled: "mean", "min" (nearest
+                             point, the flipped depth grows with distance) or "percentile".
+            pool_percentile (float): Percentile used when pool_stat is "percentile".
+            temporal (str): None, "diff" or "flow". Reuse (or, with "flow", warp) the depth of the
+                            last keyframe of each stream while the scene barely changes, see TemporalDepth.
+            temporal_threshold (float): Inter-frame change above which a new keyframe is inferred.
+            max_staleness (int): Maximum number of frames a keyframe's depth is reused for.
+            backend (str): "torch", or "onnx" to run both models with onnxruntime on the CPU
+                           (export them first with onnx_export.py).
+            red_squares_int8 (bool): Run the int8 RedSquaresGrid model saved by quantize_grid.py.
+            depth_out_size (tuple): (h, w) the depth head stops at instead of 224x224, e.g. (64, 64).
+            depth_to_grid (bool): Average the depth head output straight down to the obstacle grid,
+                                  so each cell is pooled from one value (not with cascade_crop).
+                                  Without depth_out_size the head stops at twice the grid size.
+            token_merge (float): Fraction of the DINOv2 patch tokens merged away over the blocks,
+                                 0 runs every token through every block.
         """
-        self.device = "cuda" if torch.cuda.is_available() and use_gpu else "cpu"
+        if backend == "onnx" and depth_to_grid:
+            # checked here so the frame loop never hits it in infer_tensor
+            raise ValueError("depth_to_grid needs the torch backend")
+        self.device = "cuda" if torch.cuda.is_available() and use_gpu and backend == "torch" else "cpu"
         print(f"Using device: {self.device}", flush=True)
 
-        self.depth_processor = DepthAnythingProcessor(encoder=encoder, device=self.device)
-        self.obstacle_grid_model = RedSquaresGrid(arc=red_squares_arc, run_name=red_squares_run_name, use_gpu=use_gpu)
+        self.depth_processor = DepthAnythingProcessor(encoder=encoder, device=self.device, backend=backend,
+                                                      out_size=depth_out_size, graph=not depth_to_grid,
+                                                      token_merge=token_merge)
+        self.depth_to_grid = depth_to_grid
+        self.obstacle_grid_model = RedSquaresGrid(arc=red_squares_arc, run_name=red_squares_run_name, use_gpu=use_gpu,
+                                                  que=red_squares_int8, backend=backend)
         
         self.target_size = (640, 480)
+        self.threshold = self.obstacle_grid_model.threshold
+        self.cascade = cascade
+        self.cascade_crop = cascade_crop
+        # the grid is normalized per frame (its peak cell is always 1), so whether a frame has
+        # anything in it at all is decided on the raw peak
+        self.cascade_level = cascade_level if cascade_level is not None else self.obstacle_grid_model.peak_level
+        if cascade and self.cascade_level is None:
+            raise ValueError("cascade mode needs a peak level, calibrate it with frame_red_squares.py "
+                             "or pass cascade_level")
+        self.cascade_stats = {"frames": 0, "depth_skipped": 0, "depth_cropped": 0}
+        self.pool_stat = pool_stat
+        self.pool_percentile = pool_percentile
+        self.set_temporal(temporal, temporal_threshold, max_staleness)
+        # builds both models' input tensors with cv2/NumPy into reused buffers
+        self.preprocessor = FramePreprocessor(device=self.device)
 
         print("ObstacleDetector initialized with:", flush=True)
         print(f" - Encoder: {encoder}", flush=True)
         print(f" - Red Squares Architecture: {red_squares_arc}", flush=True)
         print(f" - Red Squares Run Name: {red_squares_run_name}", flush=True)
         print(f" - Using GPU: {use_gpu}", flush=True)
+        print(f" - Backend: {backend}", flush=True)
+        if token_merge:
+            print(f" - Token merging: {token_merge:.0%} of the patch tokens", flush=True)
+        if depth_out_size is not None or depth_to_grid:
+            head_size = depth_out_size or ('2x grid' if depth_to_grid else 'full')
+            print(f" - Depth head output: {head_size}{', pooled to the grid' if depth_to_grid else ''}", flush=True)
+        print(f" - Cascade: {cascade}{' (crop)' if cascade and cascade_crop else ''}", flush=True)
+        print(f" - Temporal depth reuse: {temporal or False}", flush=True)
         print("Models loaded and ready for processing.", flush=True)
         
+    def set_temporal(self, method, threshold=0.04, max_staleness=10):
+        """Switch the temporal depth reuse (method None, "diff" or "flow") without reloading the models."""
+        if not method:
+            self.temporal = None
+        elif getattr(self, "temporal", None) is None or self.temporal.method != method:
+            self.temporal = TemporalDepth(method=method, threshold=threshold, max_staleness=max_staleness)
+
+    def warmup(self):
+        """Run both models once on a blank frame, so the first real frame does not pay for lazy initialization."""
+        frame = np.full((self.target_size[1], self.target_size[0], 3), 128, dtype=np.uint8)
+        depth_input, grid_input = self.preprocessor([frame])
+        self.obstacle_grid_model.batch_tensor(grid_input)
+        self.depth_processor.infer_tensor(depth_input)
+
     def process_frame(self, frame):
         """
         Processes a single video frame to detect obstacles and estimate their depth.
@@ -49,71 +144,165 @@ class ObstacleDetector:
             frame (np.ndarray): The input video frame in BGR format (from OpenCV).
 
         Returns:
-            np.ndarray: A 2D grid where each cell contains the average depth of a detected obstacle.
-                        Non-obstacle cells will have a value of np.nan.
+            ObstacleResult: The detection result. Its obstacle_depth_map is a 2D grid where each
+                            cell contains the average depth of a detected obstacle; non-obstacle
+                            cells have a value of np.nan.
+        """
+        return self.process_batch([frame])[0]
+
+    def process_batch(self, frames, stream_ids=None):
         """
-        # 1. Preprocess the frame
-        frame_resized = cv2.resize(frame, self.target_size)
-        frame_rgb = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
-        image = Image.fromarray(frame_rgb)
-
-        # 2. Get depth map and obstacle grid
-        depth_pil = self.depth_processor.infer_pil(image)
-        depth_np = np.array(depth_pil)
-        # Flip the depth inside out
-        min_d, max_d = np.nanmin(depth_np), np.nanmax(depth_np)
-        flipped_depth_np = max_d + min_d - depth_np
-        output_obstacles = self.obstacle_grid_model(frame_resized)
+        Processes frames from several cameras with one batched forward pass per model.
+
+        Args:
+            frames (list of np.ndarray): The input video frames in BGR format.
+            stream_ids (list): Camera of every frame, keys the keyframes in temporal mode.
+                               Defaults to the position in the batch.
 
+        Returns:
+            list of ObstacleResult: One result per frame, as returned by process_frame.
+        """
+        timings = {"batch_size": len(frames)}
+        start = time.perf_counter()
+
+        # 1. Preprocess the frames
+        frames_resized = [cv2.resize(frame, self.target_size) for frame in frames]
+        depth_input, grid_input = self.preprocessor(frames_resized)
+        timings["preprocess"] = time.perf_counter() - start
+
+        # 2. Get obstacle grids (cheap) and depth maps (expensive, skipped where not needed in cascade mode)
+        t = time.perf_counter()
+        output_obstacles, peaks = self.obstacle_grid_model.batch_tensor(grid_input, with_peak=True)
+        timings["grid"] = time.perf_counter() - t
+        t = time.perf_counter()
+        if stream_ids is None:
+            stream_ids = range(len(frames))
+        flipped_depths = self.estimate_depth(frames_resized, depth_input, output_obstacles, stream_ids, peaks)
+        timings["depth"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        results = []
+        for frame_resized, flipped_depth_np, obstacles in zip(frames_resized, flipped_depths, output_obstacles):
+            if flipped_depth_np is None:
+                grid_h, grid_w = obstacles.shape[:2]
+                obstacle_depth_map = np.full((grid_h, grid_w), np.nan, dtype=np.float32)
+            else:
+                obstacle_depth_map = self.combine(flipped_depth_np, obstacles)
+            results.append(ObstacleResult(frame_resized, flipped_depth_np, obstacles, obstacle_depth_map, timings))
+        timings["combine"] = time.perf_counter() - t
+        timings["total"] = time.perf_counter() - start
+        return results
+
+    def estimate_depth(self, frames_resized, depth_input, output_obstacles, stream_ids, peaks=None):
+        """
+        Returns the flipped float32 depth map of every frame. In cascade mode frames whose raw
+        grid peak is below cascade_level get None, and with cascade_crop the map is NaN outside
+        the crop. In temporal mode only keyframes are inferred, the other frames get the
+        keyframe's depth.
+        """
+        n = len(frames_resized)
+        flagged = output_obstacles[..., 0] > self.threshold
+        needed = list(range(n))
+        if self.cascade:
+            # the flagged cells are still needed for the crop
+            needed = [i for i in needed if peaks[i] >= self.cascade_level and flagged[i].any()]
+            self.cascade_stats["frames"] += n
+            self.cascade_stats["depth_skipped"] += n - len(needed)
+        depths = [None] * n
+        if self.temporal is not None:
+            keyframes = []
+            for i in needed:
+                depths[i] = self.temporal.propagate(stream_ids[i], frames_resized[i], flagged[i])
+                if depths[i] is None:
+                    keyframes.append(i)
+            needed = keyframes
+        if not needed:
+            return depths
+
+        if not (self.cascade and self.cascade_crop):
+            batch = depth_input if len(needed) == n else depth_input[needed]
+            pool_to = output_obstacles.shape[1:3] if self.depth_to_grid else None
+            for i, depth in zip(needed, self.depth_processor.infer_tensor(batch, pool_to=pool_to)):
+                depths[i] = self.flip_depth(depth)
+        else:
+            self.infer_crops(frames_resized, flagged, needed, depths)
+
+        if self.temporal is not None:
+            for i in needed:
+                self.temporal.keyframe(stream_ids[i], depths[i], flagged[i])
+        return depths
+
+    def infer_crops(self, frames_resized, flagged, needed, depths):
+        """Run depth on a crop around the flagged cells of the needed frames, fills depths in place."""
+        boxes = [self.crop_box(flagged[i], frames_resized[i].shape[:2]) for i in needed]
+        crops = [frames_resized[i][y1:y2, x1:x2] for i, (y1, y2, x1, x2) in zip(needed, boxes)]
+        crop_depths = self.depth_processor.infer_tensor(self.preprocessor.depth(crops))
+        for i, (y1, y2, x1, x2), depth in zip(needed, boxes, crop_depths):
+            h, w = frames_resized[i].shape[:2]
+            if (y1, y2, x1, x2) == (0, h, 0, w):
+                depths[i] = self.flip_depth(depth)
+                continue
+            self.cascade_stats["depth_cropped"] += 1
+            # paste the crop's depth into its place in a full size map
+            dh, dw = depth.shape
+            dy1, dy2 = round(y1 * dh / h), max(round(y2 * dh / h), round(y1 * dh / h) + 1)
+            dx1, dx2 = round(x1 * dw / w), max(round(x2 * dw / w), round(x1 * dw / w) + 1)
+            full = np.full((dh, dw), np.nan, dtype=np.float32)
+            full[dy1:dy2, dx1:dx2] = cv2.resize(self.flip_depth(depth), (dx2 - dx1, dy2 - dy1))
+            depths[i] = full
+
+    def crop_box(self, flagged, frame_shape, margin=1, max_fraction=0.5):
+        """
+        Pixel box (y1, y2, x1, x2) around the flagged grid cells plus a margin of cells.
+        Returns the whole frame when the box would cover more than max_fraction of it.
+        """
+        h, w = frame_shape
+        grid_h, grid_w = flagged.shape
+        rows = np.flatnonzero(flagged.any(axis=1))
+        cols = np.flatnonzero(flagged.any(axis=0))
+        r1, r2 = max(rows[0] - margin, 0), min(rows[-1] + 1 + margin, grid_h)
+        c1, c2 = max(cols[0] - margin, 0), min(cols[-1] + 1 + margin, grid_w)
+        y1, y2 = int(r1 * h / grid_h), int(r2 * h / grid_h)
+        x1, x2 = int(c1 * w / grid_w), int(c2 * w / grid_w)
+        if (y2 - y1) * (x2 - x1) > max_fraction * h * w:
+            return 0, h, 0, w
+        return y1, y2, x1, x2
+
+    @staticmethod
+    def flip_depth(depth):
+        """Flip the depth inside out."""
+        min_d, max_d = np.nanmin(depth), np.nanmax(depth)
+        return max_d + min_d - depth
+
+    def combine(self, flipped_depth_np, output_obstacles):
+        """Pool the depth over every grid cell flagged as an obstacle, see pool_stat."""
         # 3. Combine depth and obstacle information
-        h, w = flipped_depth_np.shape
-        grid_h, grid_w = output_obstacles.shape[:2]
-        cell_h, cell_w = h / grid_h, w / grid_w
-
-        obstacle_depth_map = np.full((grid_h, grid_w), np.nan, dtype=np.float32)
-
-        for i in range(grid_h):
-            for j in range(grid_w):
-                # Check if the cell is an obstacle (assuming channel 0 has the obstacle probability)
-                if output_obstacles[i, j, 0] > 0.5:
-                    # Define the region in the depth map corresponding to this grid cell
-                    y1, y2 = int(i * cell_h), int((i + 1) * cell_h)
-                    x1, x2 = int(j * cell_w), int((j + 1) * cell_w)
-                    
-                    # Extract the depth values for the cell
-                    depth_cell = flipped_depth_np[y1:y2, x1:x2]
-                    
-                    # Only compute mean if the region is non-empty
-                    if depth_cell.size > 0:
-                        cell_depth = np.nanmean(depth_cell)
-                        if not np.isnan(cell_depth):
-                            obstacle_depth_map[i, j] = cell_depth
-        
-        return obstacle_depth_map
+        grid_shape = output_obstacles.shape[:2]
+        # Channel 0 has the obstacle probability
+        obstacle_cells = output_obstacles[:, :, 0] > self.threshold
+        pooled = pool_grid(flipped_depth_np, grid_shape, stats=(self.pool_stat,),
+                           percentile=self.pool_percentile, mask=obstacle_cells)
+        return pooled[self.pool_stat]
     
-    def visualize_obstacles(self, frame, obstacle_depth_map, fig, ax):
+    def visualize_obstacles(self, result, fig, ax):
         """
         Visualizes the full depth map and obstacles in a live 3D plot, and returns it as an OpenCV image.
 
         Args:
-            frame (np.ndarray): The input video frame in BGR format.
-            obstacle_depth_map (np.ndarray): The 2D grid of obstacle depths.
+            result (ObstacleResult): The output of process_frame for the frame to show.
             fig (matplotlib.figure.Figure): The figure for plotting.
             ax (matplotlib.axes._subplots.Axes3DSubplot): The 3D axes for plotting.
 
         Returns:
             np.ndarray: The visualization as an OpenCV-compatible BGR image.
         """
-        # 1. Prepare data for visualization
-        frame_resized = cv2.resize(frame, self.target_size)
-        frame_rgb = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
-        h, w = frame_rgb.shape[:2]
-
-        # Get the full depth map for the background
-        depth_pil = self.depth_processor.infer_pil(Image.fromarray(frame_rgb))
-        depth_np = np.array(depth_pil)
-        min_d, max_d = np.nanmin(depth_np), np.nanmax(depth_np)
-        flipped_depth_np = max_d + min_d - depth_np
+        # 1. Prepare data for visualization, reusing what process_frame computed
+        h, w = result.frame.shape[:2]
+        flipped_depth_np = result.depth
+        if flipped_depth_np is None:
+            # cascade mode skipped depth, nothing was flagged on this frame
+            flipped_depth_np = np.zeros((h // 10, w // 10), dtype=np.float32)
+        obstacle_depth_map = result.obstacle_depth_map
         
         # Calculate a small offset to lift obstacle dots above the surface
         z_offset = 0
@@ -121,9 +310,6 @@ class ObstacleDetector:
             depth_range = np.nanmax(flipped_depth_np) - np.nanmin(flipped_depth_np)
             z_offset = depth_range * 0.02  # 2% of depth range
 
-        grid_h, grid_w = obstacle_depth_map.shape
-        cell_h, cell_w = h / grid_h, w / grid_w
-
         # 2. Clear and redraw the plot
         ax.clear()
         ax.set_title("Live 3D Depth Map with Obstacles")
@@ -142,16 +328,10 @@ class ObstacleDetector:
         ax.plot_surface(x, y, depth_subsampled, cmap='viridis', edgecolor='none', alpha=0.7)
 
         # Plot obstacles as red squares
-        xs, ys, zs = [], [], []
-        for i in range(grid_h):
-            for j in range(grid_w):
-                if not np.isnan(obstacle_depth_map[i, j]):
-                    y1, y2 = int(i * cell_h), int((i + 1) * cell_h)
-                    x1, x2 = int(j * cell_w), int((j + 1) * cell_w)
-                    cell_depth = obstacle_depth_map[i, j]
-                    xs.append((x1 + x2) / 2)
-                    ys.append((y1 + y2) / 2)
-                    zs.append(cell_depth - z_offset)
+        obstacle_cells = ~np.isnan(obstacle_depth_map)
+        cx, cy = cell_centers((h, w), obstacle_depth_map.shape)
+        xs, ys = cx[obstacle_cells], cy[obstacle_cells]
+        zs = obstacle_depth_map[obstacle_cells] - z_offset
 
         if len(xs) > 0:
             ax.scatter(xs, ys, zs, color='red', s=50, edgecolors='black', depthshade=True)
@@ -173,7 +353,142 @@ class ObstacleDetector:
         
         return img
 
+class DetectorLoader:
+    """
+    Builds (and warms up) an ObstacleDetector in a background thread.
+
+    Started when the process starts, so the models are usually loaded by the
+    time obstacle avoidance is enabled. `ready` is set once loading finished,
+    successfully or not (then `error` is set and `detector` stays None).
+    """
+
+    def __init__(self, **detector_kwargs):
+        self.detector_kwargs = detector_kwargs
+        self.detector = None
+        self.error = None
+        self.load_time = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._load, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            detector = ObstacleDetector(**self.detector_kwargs)
+            detector.warmup()
+            self.detector = detector
+        except Exception as e:
+            import traceback
+            print("Failed to initialize ObstacleDetector:", flush=True)
+            traceback.print_exc()
+            self.error = e
+        self.load_time = time.perf_counter() - start
+        print(f"ObstacleDetector {'ready' if self.error is None else 'failed'} after {self.load_time:.1f} s", flush=True)
+        self.ready.set()
+
+    def get(self, timeout=None):
+        """The detector once loaded, None if loading failed or is not done within timeout."""
+        self.ready.wait(timeout)
+        return self.detector
+
+
+class ObstacleVisualizer:
+    """
+    Visualization used by the live consumers: the fast 2D overlay by default, or
+    the matplotlib 3D view (mode="3d"), which is only redrawn rate_3d times per
+    second because drawing it costs more than the inference it shows.
+    """
+
+    def __init__(self, detector, mode="2d", rate_3d=1.0):
+        self.detector = detector
+        self.mode = mode
+        self.rate_3d = rate_3d
+        self.overlay = ObstacleOverlay()
+        self.fig = None
+        self.ax = None
+        self.image_3d = None
+        self.last_3d = 0.0
+
+    def render(self, result):
+        """Return the BGR visualization of an ObstacleResult."""
+        if self.mode != "3d":
+            return self.overlay.render(result)
+        now = time.monotonic()
+        if self.image_3d is None or now - self.last_3d >= 1.0 / self.rate_3d:
+            if self.fig is None:
+                self.fig = plt.figure(figsize=(10, 8))
+                self.ax = self.fig.add_subplot(111, projection='3d')
+            self.image_3d = self.detector.visualize_obstacles(result, self.fig, self.ax)
+            self.last_3d = now
+        return self.image_3d
+
+    def close(self):
+        if self.fig is not None:
+            plt.close(self.fig)
+            self.fig = self.ax = None
+        self.image_3d = None
+
+def check_cascade():
+    """
+    Cascade check without the real models: a dim frame whose normalized grid is all 1.0
+    (so every cell is above the threshold) must skip depth, a frame with a bright
+    obstacle must not, whatever else is in the batch.
+    """
+    import torch.nn.functional as F
+    from avoid_net import normalize_peak
+    from frame_red_squares import RedSquaresGrid
+
+    class GridStub(torch.nn.Module):
+        # raw activation is the brightness above mid gray, pooled to the 32x32 grid
+        def forward(self, x, normalize=True):
+            raw = F.relu(F.adaptive_avg_pool2d(x, (32, 32)))
+            return normalize_peak(raw) if normalize else raw
+
+    class DepthStub:
+        def __init__(self):
+            self.frames = 0
+
+        def infer_tensor(self, batch, as_tensor=False, pool_to=None):
+            self.frames += batch.shape[0]
+            return np.tile(np.linspace(0, 255, 224, dtype=np.float32), (batch.shape[0], 224, 1))
+
+    grid = RedSquaresGrid.__new__(RedSquaresGrid)
+    grid.backend, grid.device, grid.model, grid.normalized, grid.threshold = "torch", torch.device("cpu"), GridStub(), True, 0.5
+    detector = ObstacleDetector.__new__(ObstacleDetector)
+    detector.obstacle_grid_model = grid
+    detector.depth_processor = DepthStub()
+    detector.preprocessor = FramePreprocessor(device="cpu")
+    detector.target_size = (640, 480)
+    detector.threshold = grid.threshold
+    detector.cascade, detector.cascade_crop, detector.cascade_level = True, False, 0.5
+    detector.cascade_stats = {"frames": 0, "depth_skipped": 0, "depth_cropped": 0}
+    detector.pool_stat, detector.pool_percentile = "mean", 10
+    detector.temporal, detector.depth_to_grid = None, False
+
+    clear = np.full((480, 640, 3), 140, dtype=np.uint8)  # raw peak ~0.1
+    obstacle = clear.copy()
+    obstacle[200:300, 250:400] = 255  # raw peak 1.0
+    clear_result, obstacle_result = detector.process_batch([clear, obstacle])
+    # the normalized grid alone would have flagged every cell of the clear frame
+    assert (clear_result.obstacle_probs[..., 0] > detector.threshold).all()
+    assert clear_result.depth is None and np.isnan(clear_result.obstacle_depth_map).all()
+    assert obstacle_result.depth is not None and not np.isnan(obstacle_result.obstacle_depth_map).all()
+    assert detector.depth_processor.frames == 1
+    assert detector.cascade_stats == {"frames": 2, "depth_skipped": 1, "depth_cropped": 0}
+    # batched, the frames get the same grids as alone
+    assert np.allclose(detector.process_frame(clear).obstacle_probs, clear_result.obstacle_probs)
+    assert np.allclose(detector.process_frame(obstacle).obstacle_probs, obstacle_result.obstacle_probs)
+    print("cascade check passed: the clear frame skipped depth, the obstacle frame did not")
+
+
 if __name__ == '__main__':
+    if sys.argv[1:] == ["--check-cascade"]:
+        check_cascade()
+        sys.exit()
+
     # Example usage:
     # This part demonstrates how to use the ObstacleDetector class.
     # It reads from a sample video, processes each frame, and provides a live visualization.
@@ -181,6 +496,7 @@ if __name__ == '__main__':
     # --- Configuration ---
     video_path = "/home/ali/codebases/AvoidNet/samples/underwater_drone_sample.mp4"
     visualize = True  # Set to True to see the live visualization
+    vis_mode = "2d"  # "3d" for the matplotlib surface plot
 
     # --- Initialization ---
     detector = ObstacleDetector()
@@ -196,9 +512,7 @@ if __name__ == '__main__':
 
     # --- Initialization for Live Visualization ---
     if visualize:
-        # <<< CHANGE 2: Removed plt.ion() as it's not needed with the 'Agg' backend
-        fig = plt.figure(figsize=(10, 8))
-        ax = fig.add_subplot(111, projection='3d')
+        visualizer = ObstacleVisualizer(detector, mode=vis_mode)
 
     # --- Processing Loop ---
     while cap.isOpened():
@@ -207,19 +521,18 @@ if __name__ == '__main__':
             break
 
         # Process the frame to get the obstacle map
-        obstacle_map = detector.process_frame(frame)
+        result = detector.process_frame(frame)
+        obstacle_map = result.obstacle_depth_map
 
         if visualize:
-            # Generate the visualization image from the plot
-            vis_image = detector.visualize_obstacles(frame, obstacle_map, fig, ax)
+            # Generate the visualization image
+            vis_image = visualizer.render(result)
             
             # Display the live visualization in an OpenCV window
-            cv2.imshow('Live 3D Visualization', vis_image)
+            cv2.imshow('Obstacle Visualization', vis_image)
 
-            # Also, display the original frame for comparison
-            # Resize the original frame to match the target size for consistent display
-            frame_resized_display = cv2.resize(frame, detector.target_size)
-            cv2.imshow('Original Frame', frame_resized_display)
+            # Also, display the original frame for comparison, at the size the detector used
+            cv2.imshow('Original Frame', result.frame)
 
             # Check for 'q' key to exit the loop
             if cv2.waitKey(1) & 0xFF == ord('q'):
@@ -241,6 +554,5 @@ if __name__ == '__main__':
     cap.release()
     if visualize:
         cv2.destroyAllWindows()
-        # <<< CHANGE 3: Removed plt.ioff()
-        plt.close(fig) # Still good practice to close the figure object
+        visualizer.close()
     print(f"\nFinished processing all {frame_count} frames.")
\ No newline at end of file
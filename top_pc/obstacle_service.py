@@ -0,0 +1,239 @@
+import sys
+import select
+import time
+import argparse
+
+import numpy as np
+
+from obstacle_detector import DetectorLoader, ObstacleVisualizer
+from frame_bus import FrameBus, frame_bus_name
+
+# per-camera streams the service publishes next to the camera's frame bus
+OBSTACLE_MAP_STREAM = "obstacles"
+OBSTACLE_VIS_STREAM = "obstacle_vis"
+SOURCE_TIMEOUT = 2.0  # seconds without a new frame before the source bus is re-attached
+
+
+class CameraSlot:
+    """Frame source and result buses of one camera."""
+
+    def __init__(self, url):
+        self.url = url
+        self.frame_bus_name = frame_bus_name(url)
+        self.map_bus_name = frame_bus_name(url, OBSTACLE_MAP_STREAM)
+        self.vis_bus_name = frame_bus_name(url, OBSTACLE_VIS_STREAM)
+        self.source = None
+        self.map_bus = None
+        self.vis_bus = None
+        self.last_seq = 0
+        self.last_frame_time = time.monotonic()
+        self.visualizer = None
+
+    def newest_frame(self):
+        """Return the newest frame not processed yet, or None."""
+        if self.source is None:
+            self.source = FrameBus.attach(self.frame_bus_name)
+            if self.source is None:
+                return None
+            self.last_seq = 0
+            self.last_frame_time = time.monotonic()
+        latest = self.source.latest()
+        if latest is None or latest[0] == self.last_seq:
+            # the video process recreates its bus when the stream size changes
+            if time.monotonic() - self.last_frame_time > SOURCE_TIMEOUT:
+                self.source.close()
+                self.source = None
+            return None
+        self.last_seq = latest[0]
+        self.last_frame_time = time.monotonic()
+        return latest[2]
+
+    def publish(self, obstacle_map, vis_image=None):
+        obstacle_map = obstacle_map[:, :, np.newaxis]
+        self.map_bus = self._publish(self.map_bus, self.map_bus_name, obstacle_map)
+        if vis_image is not None:
+            self.vis_bus = self._publish(self.vis_bus, self.vis_bus_name, vis_image)
+
+    @staticmethod
+    def _publish(bus, name, array):
+        if bus is None or bus.shape != array.shape or bus.dtype != array.dtype:
+            if bus is not None:
+                bus.close()
+            bus = FrameBus.create(name, array.shape, dtype=array.dtype)
+        bus.publish(array)
+        return bus
+
+    def close(self):
+        for bus in (self.source, self.map_bus, self.vis_bus):
+            if bus is not None:
+                bus.close()
+        self.source = self.map_bus = self.vis_bus = None
+        if self.visualizer is not None:
+            self.visualizer.close()
+            self.visualizer = None
+
+
+class ObstacleService:
+    """One obstacle detector shared by every camera feed.
+
+    The video processes already publish their decoded frames on a frame bus.
+    The service takes the newest unprocessed frame of every camera, runs both
+    models once over the whole batch and publishes each camera's obstacle map
+    (and visualization) on that camera's own result bus, so the models are
+    loaded once instead of once per feed.
+
+    The GUI starts it paused when the cameras connect, so the models load in
+    the background; "resume" and "pause" then only switch the processing.
+    """
+
+    def __init__(self, urls, detector=None, visualize=True, cascade=False, cascade_crop=False, cascade_level=None, vis_mode="2d",
+                 temporal=None, max_staleness=10, backend="torch",
+                 grid_int8=False, depth_size=None, depth_to_grid=False, token_merge=0.0, paused=False):
+        self.cameras = [CameraSlot(url) for url in urls]
+        self.detector = detector
+        self.visualize = visualize
+        self.cascade = cascade
+        self.cascade_crop = cascade_crop
+        self.cascade_level = cascade_level
+        self.vis_mode = vis_mode
+        self.temporal = temporal
+        self.max_staleness = max_staleness
+        self.backend = backend
+        self.grid_int8 = grid_int8
+        self.depth_size = depth_size
+        self.depth_to_grid = depth_to_grid
+        self.token_merge = token_merge
+        self.running = False
+        self.paused = paused
+        # stats
+        self.batches = 0
+        self.frames = 0
+        self.inference_time = 0.0
+
+    def process_once(self):
+        """Process one batch, returns the number of frames in it."""
+        batch = []
+        for camera in self.cameras:
+            frame = camera.newest_frame()
+            if frame is not None:
+                batch.append((camera, frame))
+        if not batch:
+            return 0
+
+        start = time.perf_counter()
+        # keyed by url so each camera keeps its own keyframe in temporal mode
+        results = self.detector.process_batch([frame for _, frame in batch], [camera.url for camera, _ in batch])
+        self.inference_time += time.perf_counter() - start
+        self.batches += 1
+        self.frames += len(batch)
+
+        for (camera, _), result in zip(batch, results):
+            vis_image = None
+            if self.visualize:
+                if camera.visualizer is None:
+                    camera.visualizer = ObstacleVisualizer(self.detector, mode=self.vis_mode)
+                vis_image = camera.visualizer.render(result)
+            camera.publish(result.obstacle_depth_map, vis_image)
+        return len(batch)
+
+    def stats(self):
+        stats = {
+            "batches": self.batches,
+            "frames": self.frames,
+            "avg_batch": self.frames / max(self.batches, 1),
+            "ms_per_frame": 1000 * self.inference_time / max(self.frames, 1),
+        }
+        if self.cascade:
+            cascade = self.detector.cascade_stats
+            stats["cascade"] = dict(cascade, skip_rate=cascade["depth_skipped"] / max(cascade["frames"], 1))
+        if self.detector is not None and self.detector.temporal is not None:
+            stats["temporal"] = self.detector.temporal.stats()
+        return stats
+
+    def run(self):
+        loader = None
+        if self.detector is None:
+            # load in the background so stop/stats are answered while the models load
+            loader = DetectorLoader(cascade=self.cascade, cascade_crop=self.cascade_crop, cascade_level=self.cascade_level,
+                                    temporal=self.temporal,
+                                    max_staleness=self.max_staleness, backend=self.backend,
+                                    red_squares_int8=self.grid_int8, depth_to_grid=self.depth_to_grid,
+                                    token_merge=self.token_merge,
+                                    depth_out_size=(self.depth_size, self.depth_size) if self.depth_size else None).start()
+        self.running = True
+        print("Obstacle service running for", len(self.cameras), "cameras", flush=True)
+        while self.running:
+            # Check if there's any input from the parent process
+            if sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
+                command = sys.stdin.readline().strip().split()
+                if not command or command[0] == "stop":
+                    self.running = False
+                    break
+                elif command[0] == "pause":
+                    self.paused = True
+                    print("Obstacle service paused", flush=True)
+                elif command[0] == "resume":
+                    if self.paused and self.detector is not None and self.detector.temporal is not None:
+                        # the keyframes are from before the pause
+                        self.detector.temporal.reset()
+                    self.paused = False
+                    print("Obstacle service resumed", flush=True)
+                elif command[0] == "stats":
+                    if self.detector is None:
+                        print("Obstacle service stats: loading models", flush=True)
+                    else:
+                        print("Obstacle service stats:", self.stats(), flush=True)
+                else:
+                    print("Unknown command:", command, flush=True)
+            if self.detector is None:
+                if not loader.ready.wait(0.05):
+                    continue
+                if loader.detector is None:
+                    print("Obstacle service: the detector failed to load", flush=True)
+                    break
+                self.detector = loader.detector
+                print("Obstacle service ready", flush=True)
+            if self.paused:
+                time.sleep(0.05)
+                continue
+            try:
+                if self.process_once() == 0:
+                    time.sleep(0.005)  # no camera has a new frame yet
+            except Exception as e:
+                print("Exception in obstacle service:", e, flush=True)
+                time.sleep(0.1)
+        self.close()
+
+    def close(self):
+        for camera in self.cameras:
+            camera.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Obstacle detection shared by all camera feeds")
+    parser.add_argument("urls", nargs="+", help="video urls whose frame buses to process")
+    parser.add_argument("--cascade", action="store_true", help="skip depth inference on frames without obstacle cells")
+    parser.add_argument("--cascade-crop", action="store_true", help="with --cascade, run depth only around the obstacle cells")
+    parser.add_argument("--cascade-level", type=float,
+                        help="raw grid peak below which --cascade skips a frame (default: calibrated by frame_red_squares.py)")
+    parser.add_argument("--vis-3d", action="store_true", help="show the low-rate matplotlib 3D view instead of the 2D overlay")
+    parser.add_argument("--temporal", choices=("diff", "flow"), help="reuse the keyframe depth while the scene barely changes")
+    parser.add_argument("--max-staleness", type=int, default=10, help="with --temporal, frames a keyframe's depth is reused for")
+    parser.add_argument("--backend", choices=("torch", "onnx"), default="torch",
+                        help="onnx runs the models exported by onnx_export.py with onnxruntime on the CPU")
+    parser.add_argument("--grid-int8", action="store_true", help="use the int8 grid model saved by quantize_grid.py")
+    parser.add_argument("--depth-size", type=int, help="stop the depth head at this size instead of 224")
+    parser.add_argument("--depth-to-grid", action="store_true",
+                        help="average the depth head output down to the obstacle grid (the head stops at twice "
+                             "the grid size unless --depth-size is given)")
+    parser.add_argument("--token-merge", type=float, default=0.0, help="fraction of the DINOv2 patch tokens to merge away")
+    parser.add_argument("--paused", action="store_true", help="load the models but only process frames after \"resume\"")
+    args = parser.parse_args()
+
+    service = ObstacleService(args.urls, cascade=args.cascade or args.cascade_crop, cascade_crop=args.cascade_crop,
+                              cascade_level=args.cascade_level,
+                              vis_mode="3d" if args.vis_3d else "2d", temporal=args.temporal,
+                              max_staleness=args.max_staleness, backend=args.backend,
+                              grid_int8=args.grid_int8, depth_size=args.depth_size, depth_to_grid=args.depth_to_grid,
+                              token_merge=args.token_merge, paused=args.paused)
+    service.run()
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+
+# where onnx_export.py writes the graphs, relative to top_pc like models/*.pth
+ONNX_DIR = os.path.join("models", "onnx")
+BACKENDS = ("torch", "onnx")
+# metadata onnx_export.py writes into the avoid_net graphs: graphs exported before
+# the grid was normalized per sample divide by the peak of the whole batch
+GRID_NORMALIZATION_KEY = "grid_normalization"
+GRID_NORMALIZATION = "per_sample"
+# second output of the avoid_net graphs, the peak of every sample's raw activation
+GRID_PEAK_OUTPUT = "peak"
+
+
+def depth_onnx_path(encoder, input_size=(224, 224)):
+    """Default path of the exported Depth Anything graph."""
+    return os.path.join(ONNX_DIR, f"depth_anything_{encoder}14_{input_size[0]}x{input_size[1]}.onnx")
+
+
+def grid_onnx_path(arc, run_name):
+    """Default path of an exported avoid_net graph."""
+    return os.path.join(ONNX_DIR, f"{arc}_{run_name}.onnx")
+
+
+class OnnxModel:
+    """
+    An exported graph run with onnxruntime on the CPU execution provider.
+
+    Only onnxruntime is needed at run time, the torch model and the DINOv2
+    hub code are not loaded at all.
+    """
+
+    def __init__(self, path, threads=None):
+        """
+        Args:
+            path (str): The .onnx file written by onnx_export.py.
+            threads (int): Intra-op threads, None lets onnxruntime use every core.
+        """
+        import onnxruntime as ort
+
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found, export it first with onnx_export.py")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        self.metadata = self.session.get_modelmeta().custom_metadata_map
+
+    def __call__(self, batch):
+        """Run the graph on a float32 array or CPU tensor, returns a NumPy array."""
+        return self.run(batch, [self.output_name])[0]
+
+    def run(self, batch, output_names=None):
+        """Run the graph and return a list with the given outputs, all of them by default."""
+        if not isinstance(batch, np.ndarray):
+            batch = batch.numpy()
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(output_names or self.output_names, {self.input_name: batch})
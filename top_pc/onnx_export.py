@@ -0,0 +1,152 @@
+import os
+import time
+import argparse
+
+import numpy as np
+import torch
+
+from avoid_net import get_model, normalize_peak, NORMALIZED_ARCS
+from preprocess import DEPTH_INPUT_SIZE, GRID_INPUT_SIZE
+from onnx_backend import (OnnxModel, depth_onnx_path, grid_onnx_path, GRID_NORMALIZATION_KEY, GRID_NORMALIZATION,
+                          GRID_PEAK_OUTPUT)
+
+DEPTH_ENCODERS = ("vits", "vitb", "vitl")
+# the _q variant shares the weights of ImageReducer_bounded_grayscale and only
+# differs once quantized, which ONNX export does not cover
+AVOID_NET_ARCS = ("ImageReducer", "ImageReducer_bounded", "ImageReducer_bounded_grayscale")
+OPSET = 17
+# largest difference to PyTorch accepted by the parity check, depth is on its
+# raw scale so it is compared relative to the largest value
+PARITY_TOLERANCE = 1e-3
+
+
+def load_depth_anything(encoder):
+    from depth_anything.dpt import DepthAnything
+    return DepthAnything.from_pretrained(f'LiheYoung/depth_anything_{encoder}14').eval()
+
+
+def load_avoid_net(arc, run_name):
+    model = get_model(arc)
+    model.load_state_dict(torch.load(f"models/{arc}_{run_name}.pth", map_location="cpu"))
+    return model.eval()
+
+
+class GridWithPeak(torch.nn.Module):
+    """An avoid_net model that also returns the peak of every sample's raw activation (the cascade needs it)."""
+
+    def __init__(self, model, normalized):
+        super().__init__()
+        self.model = model
+        self.normalized = normalized
+
+    def forward(self, x):
+        raw = self.model(x, normalize=False) if self.normalized else self.model(x)
+        grid = normalize_peak(raw) if self.normalized else raw
+        return grid, raw.amax(dim=(1, 2, 3))
+
+
+def export(model, example, path, metadata=None, output_names=("output",)):
+    """Export a model at the example's input size, only the batch dimension is dynamic."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with torch.inference_mode():
+        torch.onnx.export(
+            model, example, path,
+            opset_version=OPSET,
+            input_names=["input"],
+            output_names=list(output_names),
+            dynamic_axes={"input": {0: "batch"}, **{name: {0: "batch"} for name in output_names}},
+            do_constant_folding=True,
+        )
+    if metadata:
+        import onnx
+
+        graph = onnx.load(path)
+        for key, value in metadata.items():
+            entry = graph.metadata_props.add()
+            entry.key, entry.value = key, value
+        onnx.save(graph, path)
+    print(f"Exported {path} ({os.path.getsize(path) / 1e6:.1f} MB)", flush=True)
+
+
+def check_parity(model, path, example, runs=10):
+    """
+    Compare the ONNX Runtime output with PyTorch on the same input, and the
+    batched output with the samples run one by one.
+
+    Returns:
+        tuple: (relative max abs difference, relative max abs difference between the batch and
+                the single samples, torch ms per batch, onnxruntime ms per batch)
+    """
+    onnx_model = OnnxModel(path)
+    with torch.inference_mode():
+        expected = model(example)
+        expected = [t.numpy() for t in (expected if isinstance(expected, tuple) else (expected,))]
+        start = time.perf_counter()
+        for _ in range(runs):
+            model(example)
+        torch_ms = 1000 * (time.perf_counter() - start) / runs
+    actual = onnx_model.run(example)
+    start = time.perf_counter()
+    for _ in range(runs):
+        onnx_model.run(example)
+    onnx_ms = 1000 * (time.perf_counter() - start) / runs
+    # no sample of a batch may depend on the others (e.g. a batch wide normalization)
+    singles = [onnx_model.run(example[i:i + 1]) for i in range(example.shape[0])]
+    difference = batch_difference = 0.0
+    for k, (want, got) in enumerate(zip(expected, actual)):
+        scale = max(np.abs(want).max(), 1e-6)
+        difference = max(difference, float(np.abs(got - want).max() / scale))
+        single = np.concatenate([outputs[k] for outputs in singles])
+        batch_difference = max(batch_difference, float(np.abs(got - single).max() / scale))
+    return difference, batch_difference, torch_ms, onnx_ms
+
+
+def export_and_check(name, model, example, path, check=True, metadata=None, output_names=("output",)):
+    export(model, example, path, metadata, output_names)
+    if not check:
+        return True
+    difference, batch_difference, torch_ms, onnx_ms = check_parity(model, path, example)
+    ok = max(difference, batch_difference) <= PARITY_TOLERANCE
+    print(f"{name}: max difference {difference:.2e}, batch vs single {batch_difference:.2e} "
+          f"({'ok' if ok else 'FAILED'}), "
+          f"torch {torch_ms:.1f} ms, onnxruntime {onnx_ms:.1f} ms per batch of {example.shape[0]}", flush=True)
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the obstacle models to ONNX and check them against PyTorch")
+    parser.add_argument("--encoders", nargs="*", default=list(DEPTH_ENCODERS), choices=DEPTH_ENCODERS,
+                        help="Depth Anything encoders to export")
+    parser.add_argument("--arcs", nargs="*", default=list(AVOID_NET_ARCS), choices=AVOID_NET_ARCS,
+                        help="avoid_net architectures to export")
+    parser.add_argument("--run-name", default="run_2", help="run name of the avoid_net weights in models/")
+    parser.add_argument("--batch", type=int, default=2, help="batch size of the example input")
+    parser.add_argument("--no-check", action="store_true", help="skip the parity check")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    failed = []
+    depth_w, depth_h = DEPTH_INPUT_SIZE
+    for encoder in args.encoders:
+        example = torch.randn(args.batch, 3, depth_h, depth_w)
+        name = f"depth_anything_{encoder}14"
+        if not export_and_check(name, load_depth_anything(encoder), example, depth_onnx_path(encoder, DEPTH_INPUT_SIZE),
+                                check=not args.no_check):
+            failed.append(name)
+
+    grid_w, grid_h = GRID_INPUT_SIZE
+    for arc in args.arcs:
+        weights = f"models/{arc}_{args.run_name}.pth"
+        if not os.path.exists(weights):
+            print(f"Skipping {arc}, {weights} not found", flush=True)
+            continue
+        model = load_avoid_net(arc, args.run_name)
+        example = torch.randn(args.batch, model.conv1.in_channels, grid_h, grid_w)
+        if not export_and_check(arc, GridWithPeak(model, arc in NORMALIZED_ARCS).eval(), example,
+                                grid_onnx_path(arc, args.run_name), check=not args.no_check,
+                                metadata={GRID_NORMALIZATION_KEY: GRID_NORMALIZATION},
+                                output_names=("output", GRID_PEAK_OUTPUT)):
+            failed.append(arc)
+
+    if failed:
+        raise SystemExit(f"Parity check failed for: {', '.join(failed)}")
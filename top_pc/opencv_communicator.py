@@ -5,9 +5,10 @@ import argparse
 import threading
 
 class opencv_communicator():
-    def __init__(self, url):
+    def __init__(self, url, prewarm=False):
         self.opencv_process = None
         self.url = url
+        self.prewarm = prewarm  # load the obstacle models in the background when the process starts
         self.output_thread = None
         self.running = False
         self.feed_title = url.split("_")[-1]
@@ -16,10 +17,10 @@ class opencv_communicator():
         if self.opencv_process is None:
             try:
                 self.opencv_process = subprocess.Popen(
-                    [sys.executable, "opencv_video.py", self.url],
+                    [sys.executable, "opencv_video.py", self.url] + (["--prewarm"] if self.prewarm else []),
                     stdin=subprocess.PIPE,
                     stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,  # read by read_output, an unread pipe would fill up and block
                     text=True,
                 )
                 if self.opencv_process.poll() is not None:
@@ -66,11 +67,12 @@ class opencv_communicator():
             self.opencv_process = None
             print("OpenCV process terminated")
             
-    def start_obstacle_avoidance(self):
+    def start_obstacle_avoidance(self, shared=False):
+        # shared: show the results of the obstacle service instead of running a detector per feed
         if self.opencv_process is not None:
             try:
                 print("Starting obstacle avoidance")
-                self.opencv_process.stdin.write("start_obstacle_avoidance\n")
+                self.opencv_process.stdin.write("start_obstacle_avoidance shared\n" if shared else "start_obstacle_avoidance\n")
                 self.opencv_process.stdin.flush()
                 time.sleep(0.1)
             except BrokenPipeError:
@@ -98,6 +100,86 @@ class opencv_communicator():
                 self.running = False
                 self.opencv_process = None
 
+class obstacle_service_communicator():
+    """Starts and stops the obstacle service shared by all camera feeds."""
+
+    def __init__(self, urls, cascade=False, temporal=None, paused=False):
+        self.service_process = None
+        self.urls = list(urls)
+        self.cascade = cascade  # skip depth inference on frames without obstacle cells
+        self.temporal = temporal  # "diff" or "flow": reuse keyframe depth while the scene is static
+        self.paused = paused  # load the models right away, process frames only after resume()
+        self.output_thread = None
+        self.running = False
+
+    def start_service(self):
+        if self.service_process is None:
+            try:
+                args = [sys.executable, "obstacle_service.py", *self.urls]
+                if self.cascade:
+                    args.append("--cascade")
+                if self.temporal:
+                    args += ["--temporal", self.temporal]
+                if self.paused:
+                    args.append("--paused")
+                self.service_process = subprocess.Popen(
+                    args,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,  # read by read_output, an unread pipe would fill up and block
+                    text=True,
+                )
+                if self.service_process.poll() is not None:
+                    self.running = False
+                    raise RuntimeError("Failed to start obstacle service")
+                print("Obstacle service started")
+                self.running = True
+                self.output_thread = threading.Thread(target=self.read_output, daemon=True)
+                self.output_thread.start()
+            except Exception as e:
+                print(f"Error starting obstacle service: {e}")
+                self.running = False
+                self.service_process = None
+
+    def read_output(self):
+        while self.running:
+            output = self.service_process.stdout.readline()
+            if output:
+                print(f"obstacle service says: {output.strip()}")
+            else:
+                break
+
+    def is_alive(self):
+        return self.service_process is not None and self.service_process.poll() is None
+
+    def send_command(self, command):
+        if self.service_process is not None:
+            try:
+                self.service_process.stdin.write(command + "\n")
+                self.service_process.stdin.flush()
+            except BrokenPipeError:
+                print("Error: obstacle service pipe is broken. Process may have terminated.")
+                self.running = False
+                self.service_process = None
+
+    def pause(self):
+        self.send_command("pause")
+
+    def resume(self):
+        self.send_command("resume")
+
+    def stop_service(self):
+        if self.service_process is not None:
+            self.running = False
+            try:
+                self.service_process.stdin.write("stop\n")
+                self.service_process.stdin.flush()
+                self.service_process.wait(timeout=2)
+            except (BrokenPipeError, subprocess.TimeoutExpired):
+                self.service_process.terminate()
+            self.service_process = None
+            print("Obstacle service stopped")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="OpenCV Communicator")
     parser.add_argument("url", help="URL to start OpenCV with")
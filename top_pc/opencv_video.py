@@ -3,11 +3,45 @@ import sys
 import select
 import time
 import threading
-from obstacle_detector import ObstacleDetector  # Assuming you have an obstacle detection module
-import matplotlib.pyplot as plt
+import argparse
+from obstacle_detector import DetectorLoader, ObstacleVisualizer  # Assuming you have an obstacle detection module
+from frame_bus import FrameBus, frame_bus_name
+from obstacle_service import OBSTACLE_VIS_STREAM, SOURCE_TIMEOUT
+from mjpeg_stream import MJPEGStream
+
+VIS_WINDOW = 'Obstacle Visualization'
+
+class FrameMailbox:
+    """Latest-value handoff from the capture loop to the obstacle worker.
+
+    The capture loop puts every new frame (no copy, it must not modify the
+    frame afterwards) and bumps a generation number. The worker waits for a
+    generation newer than the one it processed last, so a frame is never
+    processed twice and frames that arrive while it is busy are skipped.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.frame = None
+        self.timestamp = None
+        self.generation = 0
+
+    def put(self, frame, timestamp=None):
+        with self._cond:
+            self.frame = frame
+            self.timestamp = time.time() if timestamp is None else timestamp
+            self.generation += 1
+            self._cond.notify_all()
+
+    def get(self, after_generation, timeout=0.5):
+        """Return (generation, frame, timestamp) newer than after_generation, or None on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.generation > after_generation, timeout):
+                return None
+            return self.generation, self.frame, self.timestamp
 
 class VideoProcessor:
-    def __init__(self, url):
+    def __init__(self, url, prewarm=False):
         self.url = url
         self.cap = None
         self.fps = 30
@@ -19,20 +53,34 @@ class VideoProcessor:
         self.fps_list = []
         self.failing = False
         self.last_frame = None  # Store the last frame for button callback
+        self.last_frame_time = None
+        self.record_path = None
         print("VideoProcessor initialized")
         # self.start_camera()
         self.detect = False
         self.detector = None
-        self.fig = plt.figure(figsize=(10, 8))
-        self.ax = self.fig.add_subplot(111, projection='3d')
+        # the models load in a background thread, at start with prewarm or when avoidance is first enabled
+        self.detector_loader = DetectorLoader().start() if prewarm else None
+        self.obstacle_temporal = None
         self.visualize = True  # Set to True if you want to visualize the obstacles
+        self.vis_mode = "2d"  # fast OpenCV overlay, "3d" for the low-rate matplotlib view
+        self.visualizer = None
         # threading-related
         self.obstacle_thread = None
         self.obstacle_thread_running = False
         self.obstacle_lock = threading.Lock()
-        self.obstacle_frame = None
+        self.obstacle_mailbox = FrameMailbox()
+        self.obstacle_stats = {}
         self.obstacle_vis_image = None
         self.obstacle_vis_window_open = False  # Track if vis window is open
+        # decoded frames are shared with other processes through shared memory
+        self.frame_bus = None
+        self.frame_bus_name = frame_bus_name(url)
+        # in shared mode the obstacle service runs the detector and publishes its visualization
+        self.obstacle_shared = False
+        self.obstacle_vis_bus = None
+        self.obstacle_vis_seq = 0
+        self.obstacle_vis_time = time.monotonic()
 
     def avg_fps(self, fps, over=100):
         self.fps_list = self.fps_list[-over:]
@@ -40,35 +88,59 @@ class VideoProcessor:
         return sum(self.fps_list) / len(self.fps_list)
 
     def obstacle_avoidance_worker(self):
+        # wait for the models here, never in the capture loop
+        while self.obstacle_thread_running and not self.detector_loader.ready.wait(0.5):
+            pass
+        if not self.obstacle_thread_running:
+            return
+        if self.detector_loader.detector is None:
+            print("ObstacleDetector failed to load, obstacle avoidance disabled")
+            self.detect = False
+            self.obstacle_thread_running = False
+            return
+        self.detector = self.detector_loader.detector
+        self.detector.set_temporal(self.obstacle_temporal)
+        if self.visualizer is None:
+            self.visualizer = ObstacleVisualizer(self.detector, mode=self.vis_mode)
+        print("ObstacleDetector ready")
+
+        generation = self.obstacle_mailbox.generation
+        started = time.monotonic()
+        busy = 0.0
+        stats = {"processed": 0, "dropped": 0, "age_ms": 0.0, "max_age_ms": 0.0, "utilization": 0.0}
+        self.obstacle_stats = stats
         while self.obstacle_thread_running:
-            with self.obstacle_lock:
-                frame = self.obstacle_frame
-            if frame is not None and self.detector is not None:
-                try:
-                    obstacle_map = self.detector.process_frame(frame)
-                    if self.visualize:
-                        vis_image = self.detector.visualize_obstacles(frame, obstacle_map, self.fig, self.ax)
-                        with self.obstacle_lock:
-                            self.obstacle_vis_image = vis_image
-                except Exception as e:
-                    print("Exception in obstacle avoidance thread:", e)
-            time.sleep(0.01)  # avoid busy loop
+            # blocks until the capture loop has a newer frame, skipping any we were too slow for
+            item = self.obstacle_mailbox.get(generation)
+            if item is None or self.detector is None:
+                continue
+            new_generation, frame, timestamp = item
+            stats["dropped"] += max(new_generation - generation - 1, 0)
+            generation = new_generation
+            age_ms = 1000 * (time.time() - timestamp)
+            work_start = time.monotonic()
+            try:
+                result = self.detector.process_frame(frame)
+                if self.visualize:
+                    vis_image = self.visualizer.render(result)
+                    with self.obstacle_lock:
+                        self.obstacle_vis_image = vis_image
+            except Exception as e:
+                print("Exception in obstacle avoidance thread:", e)
+            now = time.monotonic()
+            busy += now - work_start
+            stats["processed"] += 1
+            stats["age_ms"] = age_ms
+            stats["max_age_ms"] = max(stats["max_age_ms"], age_ms)
+            stats["utilization"] = busy / max(now - started, 1e-6)
 
     def start_camera(self):
         print ("Starting camera with url: ", self.url)
-        self.cap = cv2.VideoCapture(self.url)  # Use the URL for video capture
-        # fps and resolution
-        if not self.cap.isOpened():
-            print("Error: Could not open the video device")
-            sys.exit(1)
-        self.fps = int(self.cap.get(cv2.CAP_PROP_FPS))
-        # self.fps = 30
-        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        self.sleep_time = 1 / self.fps
+        # keeps only the newest JPEG and reconnects on its own, so a stream that
+        # is not up yet is simply waited for
+        self.cap = MJPEGStream(self.url).start()
 
         while True:
-            start = time.time()
             # Check if there's any input from the parent process
             if sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
                 command = sys.stdin.readline().strip().split()
@@ -78,13 +150,15 @@ class VideoProcessor:
                 elif command[0] == "show_stream":
                     self.show_stream = True
                 elif command[0] == "start_recording":
-                    print(f"Recording at {self.fps} fps and {self.width}x{self.height} resolution")
-                    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-                    self.out = cv2.VideoWriter(command[1], fourcc, self.fps, (self.width, self.height))
+                    # the writer is opened on the next frame, once the frame size is known
+                    self.record_path = command[1]
+                    self.out = None
                     self.recording = True
                 elif command[0] == "stop_recording":
                     if self.recording:
-                        self.out.release()
+                        if self.out is not None:
+                            self.out.release()
+                            self.out = None
                         self.recording = False
                         print("Recording stopped")
                     else:
@@ -92,18 +166,18 @@ class VideoProcessor:
                 elif command[0] == "start_obstacle_avoidance":
                     print("opencv_video: Starting obstacle avoidance")
                     self.detect = True
-                    try:
-                        self.detector = ObstacleDetector()
-                        print("ObstacleDetector initialized")
-                    except Exception as e:
-                        import traceback
-                        print("Failed to initialize ObstacleDetector:")
-                        traceback.print_exc()
-                        self.detect = False
+                    if len(command) > 1 and command[1] == "shared":
+                        # the obstacle service already reads our frame bus
+                        self.obstacle_shared = True
+                        self.obstacle_vis_window_open = True
                         continue
-                    if not hasattr(self, 'fig') or not hasattr(self, 'ax'):
-                        self.fig = plt.figure(figsize=(10, 8))
-                        self.ax = self.fig.add_subplot(111, projection='3d')
+                    # "start_obstacle_avoidance diff|flow" reuses keyframe depth while the scene is static
+                    self.obstacle_temporal = command[1] if len(command) > 1 and command[1] in ("diff", "flow") else None
+                    if self.detector_loader is None or self.detector_loader.error is not None:
+                        # not prewarmed (or that failed), the worker waits for the models
+                        self.detector_loader = DetectorLoader().start()
+                    elif self.detector is not None:
+                        self.detector.set_temporal(self.obstacle_temporal)
                     # Start obstacle avoidance thread
                     if self.obstacle_thread is None or not self.obstacle_thread.is_alive():
                         self.obstacle_thread_running = True
@@ -113,49 +187,78 @@ class VideoProcessor:
                 elif command[0] == "stop_obstacle_avoidance":
                     print("opencv_video: Stopping obstacle avoidance")
                     self.detect = False
+                    self.obstacle_shared = False
+                    self.close_obstacle_vis_bus()
                     self.obstacle_thread_running = False
                     if self.obstacle_thread is not None:
                         self.obstacle_thread.join(timeout=1)
                         self.obstacle_thread = None
                     # Close the visualization window if open
                     if self.obstacle_vis_window_open:
-                        cv2.destroyWindow('Live 3D Visualization')
+                        cv2.destroyWindow(VIS_WINDOW)
                         self.obstacle_vis_window_open = False
-                    if hasattr(self, 'fig') and hasattr(self, 'ax'):
-                        plt.close(self.fig)
-                        self.fig = None
-                        self.ax = None
+                    if self.visualizer is not None:
+                        self.visualizer.close()
+                        self.visualizer = None
+                elif command[0] == "vis_mode" and len(command) > 1:
+                    # "2d" or "3d", used by the local detector
+                    self.vis_mode = command[1]
+                    if self.visualizer is not None:
+                        self.visualizer.mode = self.vis_mode
+                elif command[0] == "stats":
+                    print("Stream stats:", self.cap.stats(), flush=True)
+                    if self.detector_loader is not None:
+                        loader = self.detector_loader
+                        state = "loading" if not loader.ready.is_set() else "failed" if loader.error else "ready"
+                        print(f"Obstacle models: {state}", flush=True)
+                    if self.obstacle_thread is not None:
+                        print("Obstacle worker stats:", self.obstacle_stats, flush=True)
+                        if self.detector is not None and self.detector.cascade:
+                            print("Cascade stats:", self.detector.cascade_stats, flush=True)
+                        if self.detector is not None and self.detector.temporal is not None:
+                            print("Temporal depth stats:", self.detector.temporal.stats(), flush=True)
                 else:
                     print("Unknown command:", command)
 
-            # Normal OpenCV operations
-            ret, frame = self.cap.read()
+            # Normal OpenCV operations, returns only when a new frame arrived
+            ret, frame = self.cap.read(timeout=0.05)
             if not ret:
-                if not self.failing:
-                    print("Failed to grab frame")
-                self.failing = True
-                pass
+                if not self.cap.connected:
+                    if not self.failing:
+                        print("Waiting for the video stream")
+                    self.failing = True
             else:
                 self.failing = False
+                now = time.time()
+                if self.last_frame_time is not None:
+                    self.fps = self.avg_fps(1 / max(now - self.last_frame_time, 1e-6))
+                self.last_frame_time = now
+                self.height, self.width = frame.shape[:2]
                 self.last_frame = frame  # Store the latest frame
+                self.publish_frame(frame)
                 if self.detect:
-                    with self.obstacle_lock:
-                        self.obstacle_frame = frame.copy()
+                    if self.obstacle_shared:
+                        self.read_obstacle_service()
+                    else:
+                        # handed over without a copy, the frame is not modified after this
+                        self.obstacle_mailbox.put(frame, now)
                     with self.obstacle_lock:
                         vis_image = self.obstacle_vis_image
                     if self.visualize and vis_image is not None and self.detect:
-                        cv2.imshow('Live 3D Visualization', vis_image)
+                        cv2.imshow(VIS_WINDOW, vis_image)
                         self.obstacle_vis_window_open = True
                         # Check for 'q' key to exit the loop
                         if cv2.waitKey(1) & 0xFF == ord('q'):
                             break
                     elif not self.detect and self.obstacle_vis_window_open:
-                        cv2.destroyWindow('Live 3D Visualization')
+                        cv2.destroyWindow(VIS_WINDOW)
                         self.obstacle_vis_window_open = False
                 if self.recording:
                     self.save_frame(frame)
                 if self.show_stream:
-                    # draw fps on the frame
+                    # draw fps on the frame, on a copy while the obstacle worker may be reading it
+                    if self.detect and not self.obstacle_shared:
+                        frame = frame.copy()
                     cv2.putText(frame, f"FPS: {self.fps:.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
                     cv2.imshow("Video Feed", frame)
 
@@ -163,13 +266,10 @@ class VideoProcessor:
                     self.show_stream = False
                     cv2.destroyAllWindows()
 
-            # # limit the loop speed to the camera's FPS
-            # time.sleep(self.sleep_time)
-            end = time.time()
-            self.fps = self.avg_fps(1 / (end - start))
-
         self.cap.release()
         cv2.destroyAllWindows()
+        self.close_frame_bus()
+        self.close_obstacle_vis_bus()
         # Stop thread if running
         self.obstacle_thread_running = False
         if self.obstacle_thread is not None:
@@ -177,10 +277,54 @@ class VideoProcessor:
             self.obstacle_thread = None
         # Ensure visualization window is closed
         if self.obstacle_vis_window_open:
-            cv2.destroyWindow('Live 3D Visualization')
+            cv2.destroyWindow(VIS_WINDOW)
             self.obstacle_vis_window_open = False
 
+    def publish_frame(self, frame):
+        # (re)create the bus when the first frame arrives or the stream size changes
+        if self.frame_bus is None or self.frame_bus.shape != frame.shape:
+            if self.frame_bus is not None:
+                self.frame_bus.close()
+            self.frame_bus = FrameBus.create(self.frame_bus_name, frame.shape)
+        self.frame_bus.publish(frame)
+
+    def close_frame_bus(self):
+        if self.frame_bus is not None:
+            self.frame_bus.close()
+            self.frame_bus = None
+
+    def read_obstacle_service(self):
+        # pick up the newest visualization the obstacle service made for this feed
+        if self.obstacle_vis_bus is None:
+            self.obstacle_vis_bus = FrameBus.attach(frame_bus_name(self.url, OBSTACLE_VIS_STREAM))
+            if self.obstacle_vis_bus is None:
+                return
+            self.obstacle_vis_time = time.monotonic()
+        latest = self.obstacle_vis_bus.latest()
+        if latest is None or latest[0] == self.obstacle_vis_seq:
+            # the service recreates the bus when the visualization size changes or it restarts
+            if time.monotonic() - self.obstacle_vis_time > SOURCE_TIMEOUT:
+                self.obstacle_vis_bus.close()
+                self.obstacle_vis_bus = None
+            return
+        self.obstacle_vis_seq = latest[0]
+        self.obstacle_vis_time = time.monotonic()
+        with self.obstacle_lock:
+            self.obstacle_vis_image = latest[2]
+
+    def close_obstacle_vis_bus(self):
+        if self.obstacle_vis_bus is not None:
+            self.obstacle_vis_bus.close()
+            self.obstacle_vis_bus = None
+            self.obstacle_vis_seq = 0
+        with self.obstacle_lock:
+            self.obstacle_vis_image = None
+
     def save_frame(self, frame):
+        if self.out is None:
+            print(f"Recording at {self.fps:.1f} fps and {self.width}x{self.height} resolution")
+            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+            self.out = cv2.VideoWriter(self.record_path, fourcc, self.fps, (self.width, self.height))
         self.out.write(frame)
         
     def stop_camera(self):
@@ -189,10 +333,10 @@ class VideoProcessor:
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python opencv_video.py <video_url>")
-        sys.exit(1)
-    
-    video_url = sys.argv[1]
-    processor = VideoProcessor(video_url)
+    parser = argparse.ArgumentParser(description="Video feed with optional obstacle avoidance")
+    parser.add_argument("url", help="video url")
+    parser.add_argument("--prewarm", action="store_true", help="load the obstacle models in the background at start")
+    args = parser.parse_args()
+
+    processor = VideoProcessor(args.url, prewarm=args.prewarm)
     processor.start_camera()
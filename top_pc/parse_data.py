@@ -1,7 +1,49 @@
+import struct
+
+# Binary telemetry frame sent by the Teensy once the PC asks for it with
+# "telemetry: binary". Must match TelemetryFrame in teensy/main_code/main_code.ino.
+#   magic (2s) | version (B) | status flags (B) | sequence (I) | device millis (I) |
+#   Pressure, Temperature, Depth, Altitude, Roll, Pitch, Yaw (7 x float32)
+TELEMETRY_MAGIC = b"BT"
+TELEMETRY_VERSION = 1
+TELEMETRY_STRUCT = struct.Struct("<2sBBII7f")
+TELEMETRY_FIELDS = ("Pressure", "Temperature", "Depth", "Altitude", "Roll", "Pitch", "Yaw")
+
+# bits of the status flags byte
+DEPTH_STATUS_BIT = 0x01
+IMU_STATUS_BIT = 0x02
+
+# commands the PC sends to the Teensy to pick the telemetry format
+TELEMETRY_BINARY_REQUEST = b"telemetry: binary"
+TELEMETRY_TEXT_REQUEST = b"telemetry: text"
+
+
+def is_binary_telemetry(packet):
+    return packet[:2] == TELEMETRY_MAGIC
+
+
 class SensorDataParser:
     def __call__(self, data):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            if is_binary_telemetry(data):
+                return self.parse_binary_data(data)
+            data = bytes(data).decode()
         return self.parse_sensor_data(data)
 
+    def parse_binary_data(self, packet):
+        if len(packet) < TELEMETRY_STRUCT.size:
+            raise ValueError(f"Telemetry frame too short: {len(packet)} bytes")
+        magic, version, flags, seq, device_time, *values = TELEMETRY_STRUCT.unpack_from(packet)
+        if version != TELEMETRY_VERSION:
+            raise ValueError(f"Unsupported telemetry version: {version}")
+
+        sensor_data = dict(zip(TELEMETRY_FIELDS, values))
+        sensor_data["depthStatus"] = int(bool(flags & DEPTH_STATUS_BIT))
+        sensor_data["imuStatus"] = int(bool(flags & IMU_STATUS_BIT))
+        sensor_data["seq"] = seq
+        sensor_data["deviceTime"] = device_time
+        return sensor_data
+
     def parse_sensor_data(self, data):
         # Split the data into lines
         lines = data.split("\n")[1:]  # Skip the first line
@@ -24,11 +66,17 @@ class SensorDataParser:
 
         return sensor_data
 
-# Usage
-parser = SensorDataParser()
-data = """header
+
+if __name__ == "__main__":
+    # Usage
+    parser = SensorDataParser()
+    data = """header
 temperature: 23.5
 humidity: 45
 status: OK"""
-parsed_data = parser(data)
-print(parsed_data)
+    parsed_data = parser(data)
+    print(parsed_data)
+
+    frame = TELEMETRY_STRUCT.pack(TELEMETRY_MAGIC, TELEMETRY_VERSION, DEPTH_STATUS_BIT | IMU_STATUS_BIT,
+                                  42, 123456, 1013.2, 21.5, 3.2, -1.0, 1.5, -2.5, 90.0)
+    print(len(frame), "bytes:", parser(frame))
@@ -0,0 +1,132 @@
+import time
+
+import cv2
+import numpy as np
+import torch
+
+# Input sizes and normalization of the two detector models, same as the
+# torchvision transforms in DepthAnythingProcessor and SUIMGrayscaleTransformOnly.
+DEPTH_INPUT_SIZE = (224, 224)
+DEPTH_MEAN = (0.485, 0.456, 0.406)
+DEPTH_STD = (0.229, 0.224, 0.225)
+GRID_INPUT_SIZE = (155, 155)
+GRID_MEAN = 0.5
+GRID_STD = 0.5
+
+
+class FramePreprocessor:
+    """Builds the input tensors of both detector models straight from BGR frames.
+
+    Replaces the PIL + torchvision pipelines (Image.fromarray, Resize, ToTensor,
+    Normalize, Grayscale) with cv2 resizes and NumPy arithmetic that write into
+    input buffers allocated once and reused for every batch. On CUDA the
+    buffers are pinned so the copy to the device can run asynchronously.
+    """
+
+    def __init__(self, device="cpu", max_batch=2):
+        self.device = torch.device(device)
+        self.pin = self.device.type == "cuda"
+        # per channel affine transform equivalent to ToTensor + Normalize, in RGB order
+        self.depth_scale = np.array([1.0 / (255.0 * s) for s in DEPTH_STD], dtype=np.float32)
+        self.depth_offset = np.array([-m / s for m, s in zip(DEPTH_MEAN, DEPTH_STD)], dtype=np.float32)
+        self.grid_scale = np.float32(1.0 / (255.0 * GRID_STD))
+        self.grid_offset = np.float32(-GRID_MEAN / GRID_STD)
+        self._allocate(max_batch)
+
+    def _allocate(self, max_batch):
+        self.max_batch = max_batch
+        depth_w, depth_h = DEPTH_INPUT_SIZE
+        grid_w, grid_h = GRID_INPUT_SIZE
+        self.depth_buffer = torch.empty((max_batch, 3, depth_h, depth_w), dtype=torch.float32, pin_memory=self.pin)
+        self.grid_buffer = torch.empty((max_batch, 1, grid_h, grid_w), dtype=torch.float32, pin_memory=self.pin)
+        # NumPy views of the same memory, cv2 and NumPy write into them directly
+        self._depth_np = self.depth_buffer.numpy()
+        self._grid_np = self.grid_buffer.numpy()
+        self._resized = np.empty((depth_h, depth_w, 3), dtype=np.uint8)
+        self._resized_grid = np.empty((grid_h, grid_w, 3), dtype=np.uint8)
+        self._gray = np.empty((grid_h, grid_w), dtype=np.uint8)
+
+    def __call__(self, frames):
+        """Return (depth input, grid input) tensors on the device for a list of BGR frames.
+
+        The tensors share memory with the reusable buffers, so they are only
+        valid until the next call.
+        """
+        n = len(frames)
+        if n > self.max_batch:
+            self._allocate(n)
+        with torch.inference_mode():
+            for i, frame in enumerate(frames):
+                self.fill(i, frame)
+            depth_input = self.depth_buffer[:n].to(self.device, non_blocking=self.pin)
+            grid_input = self.grid_buffer[:n].to(self.device, non_blocking=self.pin)
+        return depth_input, grid_input
+
+    def depth(self, frames):
+        """Return only the depth input tensor, e.g. for crops of the frames."""
+        n = len(frames)
+        if n > self.max_batch:
+            self._allocate(n)
+        with torch.inference_mode():
+            for i, frame in enumerate(frames):
+                self.fill_depth(i, frame)
+            return self.depth_buffer[:n].to(self.device, non_blocking=self.pin)
+
+    def fill(self, i, frame):
+        """Write slot i of both input buffers from one BGR frame."""
+        self.fill_depth(i, frame)
+        self.fill_grid(i, frame)
+
+    def fill_depth(self, i, frame):
+        # INTER_AREA comes closest to the antialiased PIL resize the models were used with
+        cv2.resize(frame, DEPTH_INPUT_SIZE, dst=self._resized, interpolation=cv2.INTER_AREA)
+        out = self._depth_np[i]
+        for c in range(3):
+            # BGR frame, RGB tensor
+            np.multiply(self._resized[:, :, 2 - c], self.depth_scale[c], out=out[c], casting="unsafe")
+            out[c] += self.depth_offset[c]
+
+    def fill_grid(self, i, frame):
+        cv2.resize(frame, GRID_INPUT_SIZE, dst=self._resized_grid, interpolation=cv2.INTER_AREA)
+        # RedSquaresGrid has always converted the BGR frame as if it were RGB, keep
+        # the same channel weights so the model sees what it was used with
+        cv2.cvtColor(self._resized_grid, cv2.COLOR_RGB2GRAY, dst=self._gray)
+        out = self._grid_np[i, 0]
+        np.multiply(self._gray, self.grid_scale, out=out, casting="unsafe")
+        out += self.grid_offset
+
+
+if __name__ == "__main__":
+    # Micro-benchmark against the PIL/torchvision pipelines this replaces.
+    from PIL import Image
+    from torchvision.transforms import Compose, Resize, ToTensor, Normalize
+    from dataset import SUIMGrayscaleTransformOnly
+
+    depth_transform = Compose([
+        Resize(DEPTH_INPUT_SIZE),
+        ToTensor(),
+        Normalize(mean=DEPTH_MEAN, std=DEPTH_STD),
+    ])
+    grid_transform = SUIMGrayscaleTransformOnly().get_transform()
+
+    def reference(frames):
+        depth = torch.stack([depth_transform(Image.fromarray(cv2.cvtColor(f, cv2.COLOR_BGR2RGB))) for f in frames])
+        grid = torch.stack([grid_transform(Image.fromarray(f)) for f in frames])
+        return depth, grid
+
+    rng = np.random.default_rng(0)
+    frames = [cv2.GaussianBlur(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8), (0, 0), 3) for _ in range(2)]
+    preprocessor = FramePreprocessor(max_batch=len(frames))
+
+    ref_depth, ref_grid = reference(frames)
+    depth, grid = preprocessor(frames)
+    print(f"max abs difference: depth {float((depth - ref_depth).abs().max()):.4f}, "
+          f"grid {float((grid - ref_grid).abs().max()):.4f}")
+
+    for name, fn in (("PIL/torchvision", reference), ("cv2/NumPy", preprocessor)):
+        runs = 200
+        start = time.perf_counter()
+        for _ in range(runs):
+            fn(frames)
+        elapsed = (time.perf_counter() - start) / (runs * len(frames))
+        print(f"{name:16s} {1000 * elapsed:.3f} ms per frame")
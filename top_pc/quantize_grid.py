@@ -0,0 +1,142 @@
+import os
+import time
+import platform
+import argparse
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Subset
+
+from avoid_net import get_model
+from dataset import SUIM_grayscale
+
+QUANTIZED_ARC = "ImageReducer_bounded_grayscale"
+
+
+def default_engine():
+    """Quantized engine of this machine: qnnpack on ARM (the Pi), x86/fbgemm otherwise."""
+    engines = torch.backends.quantized.supported_engines
+    if platform.machine().lower() in ("aarch64", "arm64", "armv7l") and "qnnpack" in engines:
+        return "qnnpack"
+    return "x86" if "x86" in engines else "fbgemm"
+
+
+def quantized_path(arc, run_name, engine):
+    """Where the int8 weights of a float run are saved, next to its .pth."""
+    return f"models/{arc}_{run_name}_int8_{engine}.pth"
+
+
+def load_float(arc, run_name):
+    """The float weights in the _q architecture, ready to be prepared."""
+    model = get_model(arc + "_q")
+    model.load_state_dict(torch.load(f"models/{arc}_{run_name}.pth", map_location="cpu"))
+    return model.eval()
+
+
+def quantize(model, loader, engine, batches=None):
+    """
+    Fuse, insert observers, calibrate on the loader's images and convert to int8.
+
+    Args:
+        model (ImageReducer_bounded_grayscale_q): Float model with its trained weights.
+        loader (DataLoader): Calibration images, e.g. from SUIM_grayscale.
+        engine (str): Quantized engine, see default_engine.
+        batches (int): Number of batches to calibrate on, None for the whole loader.
+
+    Returns:
+        The converted int8 model.
+    """
+    model.prepare_static(engine)
+    with torch.inference_mode():
+        for i, (images, _) in enumerate(loader):
+            if batches is not None and i >= batches:
+                break
+            model(images)
+    return torch.quantization.convert(model, inplace=True)
+
+
+def load_quantized(arc, run_name, engine=None):
+    """Rebuild the quantized module structure and load int8 weights saved by this tool."""
+    engine = engine or default_engine()
+    model = get_model(arc + "_q").prepare_static(engine)
+    torch.quantization.convert(model, inplace=True)
+    model.load_state_dict(torch.load(quantized_path(arc, run_name, engine), map_location="cpu"))
+    return model.eval()
+
+
+def latency(model, batch, runs=50):
+    """Milliseconds per forward pass of a batch."""
+    with torch.inference_mode():
+        for _ in range(5):
+            model(batch)
+        start = time.perf_counter()
+        for _ in range(runs):
+            model(batch)
+    return 1000 * (time.perf_counter() - start) / runs
+
+
+def compare(float_model, int8_model, loader, threshold=0.5):
+    """
+    Grid agreement of the int8 model with the float model.
+
+    Returns:
+        dict: agreement (fraction of cells with the same obstacle decision),
+              flagged (cells the float model flags), mean_abs_diff of the probabilities.
+    """
+    same = cells = flagged = 0
+    abs_diff = 0.0
+    with torch.inference_mode():
+        for images, _ in loader:
+            # every sample is normalized by its own peak, so a batch matches single frames
+            expected = float_model(images).numpy()
+            actual = int8_model(images).numpy()
+            same += int(((expected > threshold) == (actual > threshold)).sum())
+            flagged += int((expected > threshold).sum())
+            cells += expected.size
+            abs_diff += float(np.abs(expected - actual).sum())
+    return {"agreement": same / max(cells, 1), "flagged": flagged / max(cells, 1),
+            "mean_abs_diff": abs_diff / max(cells, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post-training static int8 quantization of the obstacle grid model")
+    parser.add_argument("data", help="SUIM dataset directory (with images/ and the grided masks)")
+    parser.add_argument("--run-name", default="run_2", help="run name of the float weights in models/")
+    parser.add_argument("--engine", default=None, help="quantized engine, x86/fbgemm or qnnpack (default: this machine's)")
+    parser.add_argument("--calibration", type=int, default=200, help="number of images to calibrate on")
+    parser.add_argument("--evaluation", type=int, default=200, help="number of other images to compare on")
+    parser.add_argument("--threshold", type=float, default=0.5, help="obstacle probability threshold")
+    args = parser.parse_args()
+
+    engine = args.engine or default_engine()
+    torch.backends.quantized.engine = engine
+    dataset = SUIM_grayscale(args.data)
+    order = np.random.default_rng(0).permutation(len(dataset)).tolist()
+    calibration = Subset(dataset, order[:args.calibration])
+    evaluation = Subset(dataset, order[args.calibration:args.calibration + args.evaluation])
+
+    float_model = load_float(QUANTIZED_ARC, args.run_name)
+    int8_model = quantize(load_float(QUANTIZED_ARC, args.run_name), DataLoader(calibration, batch_size=8), engine)
+    path = quantized_path(QUANTIZED_ARC, args.run_name, engine)
+    torch.save(int8_model.state_dict(), path)
+    print(f"Saved {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+    # check the saved file loads back to the same outputs
+    loaded = load_quantized(QUANTIZED_ARC, args.run_name, engine)
+    sample = torch.stack([dataset[i][0] for i in order[:2]])
+    with torch.inference_mode():
+        assert torch.equal(loaded(sample), int8_model(sample)), "reloaded model differs"
+        # the first frame's grid must not depend on the other frame of the batch
+        single = int8_model(sample[:1])
+        assert torch.allclose(int8_model(sample)[:1], single, atol=1e-6), "batched output depends on the batch"
+
+    print(f"\nEngine {engine}, {torch.get_num_threads()} threads")
+    for batch_size in (1, 2):
+        batch = torch.stack([dataset[i][0] for i in order[:batch_size]])
+        float_ms = latency(float_model, batch)
+        int8_ms = latency(int8_model, batch)
+        print(f"batch {batch_size}: float {float_ms:.2f} ms, int8 {int8_ms:.2f} ms ({float_ms / int8_ms:.1f}x)")
+    report = compare(float_model, int8_model, DataLoader(evaluation, batch_size=8), args.threshold)
+    print(f"grid agreement {100 * report['agreement']:.2f}% over {len(evaluation)} images "
+          f"({100 * report['flagged']:.1f}% of cells flagged), mean abs probability difference "
+          f"{report['mean_abs_diff']:.4f}")
@@ -43,9 +43,13 @@ class DataLogger:
         for feed in self.video_feed:
             feed.stop_recording()
 
-    def log_data(self, data):
+    def log_data(self, data, timestamp=None):
         if self.writer:
-            timestamp = datetime.now().isoformat()
+            # timestamp is the host receive time (seconds since epoch) if known
+            if timestamp is None:
+                timestamp = datetime.now().isoformat()
+            else:
+                timestamp = datetime.fromtimestamp(timestamp).isoformat()
             self.writer.writerow([timestamp, data])
         else:
             raise RuntimeError("Recording has not been started. Call start_recording() first.")
@@ -0,0 +1,226 @@
+import selectors
+import socket
+import threading
+import time
+
+import numpy as np
+
+from parse_data import (
+    SensorDataParser,
+    TELEMETRY_FIELDS,
+    TELEMETRY_STRUCT,
+    TELEMETRY_VERSION,
+    DEPTH_STATUS_BIT,
+    IMU_STATUS_BIT,
+    is_binary_telemetry,
+)
+
+# Wire layout of a binary telemetry frame, same as TELEMETRY_STRUCT, so a whole
+# batch of frames can be decoded with one np.frombuffer call.
+TELEMETRY_WIRE_DTYPE = np.dtype(
+    [("magic", "S2"), ("version", "u1"), ("flags", "u1"), ("seq", "<u4"), ("deviceTime", "<u4")]
+    + [(name, "<f4") for name in TELEMETRY_FIELDS]
+)
+assert TELEMETRY_WIRE_DTYPE.itemsize == TELEMETRY_STRUCT.size
+
+# One telemetry sample as stored in the ring buffer. Field names match the keys
+# produced by SensorDataParser so consumers can keep using data['Pitch'] etc.
+TELEMETRY_DTYPE = np.dtype(
+    [("hostTime", "f8"), ("seq", "i8"), ("deviceTime", "i8")]
+    + [(name, "f4") for name in TELEMETRY_FIELDS]
+    + [("depthStatus", "u1"), ("imuStatus", "u1")]
+)
+
+
+class TelemetryRingBuffer:
+    """Preallocated ring of telemetry samples shared by the receiver and its consumers.
+
+    The receiver appends, consumers either look at the newest sample or keep a
+    cursor and read everything written since (see read_since).
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.samples = np.zeros(capacity, dtype=TELEMETRY_DTYPE)
+        self.count = 0  # total number of samples ever written
+        self.lock = threading.Lock()
+
+    def append(self, data, host_time=None):
+        """Append one parsed telemetry dict (text packets)."""
+        with self.lock:
+            sample = self.samples[self.count % self.capacity]
+            sample["hostTime"] = time.time() if host_time is None else host_time
+            sample["seq"] = data.get("seq", -1)
+            sample["deviceTime"] = data.get("deviceTime", -1)
+            for name in TELEMETRY_FIELDS:
+                sample[name] = data.get(name, np.nan)
+            sample["depthStatus"] = data.get("depthStatus", 0)
+            sample["imuStatus"] = data.get("imuStatus", 0)
+            self.count += 1
+
+    def extend_frames(self, frames, host_time=None):
+        """Append a batch of binary frames decoded with TELEMETRY_WIRE_DTYPE."""
+        n = len(frames)
+        if n == 0:
+            return
+        if n > self.capacity:
+            frames = frames[-self.capacity:]
+            n = self.capacity
+        host_time = time.time() if host_time is None else host_time
+        with self.lock:
+            idx = (self.count + np.arange(n)) % self.capacity
+            self.samples["hostTime"][idx] = host_time
+            self.samples["seq"][idx] = frames["seq"]
+            self.samples["deviceTime"][idx] = frames["deviceTime"]
+            for name in TELEMETRY_FIELDS:
+                self.samples[name][idx] = frames[name]
+            self.samples["depthStatus"][idx] = (frames["flags"] & DEPTH_STATUS_BIT) != 0
+            self.samples["imuStatus"][idx] = (frames["flags"] & IMU_STATUS_BIT) != 0
+            self.count += n
+
+    def latest(self):
+        """Return the newest sample as a dict, or None if nothing was received yet."""
+        with self.lock:
+            if self.count == 0:
+                return None
+            return self.to_dict(self.samples[(self.count - 1) % self.capacity])
+
+    def read_since(self, cursor):
+        """Return (samples, new_cursor) with every sample written after cursor.
+
+        Samples that were already overwritten are skipped, so a slow consumer
+        loses the oldest data instead of blocking the receiver.
+        """
+        with self.lock:
+            count = self.count
+            start = max(cursor, count - self.capacity)
+            if start >= count:
+                return self.samples[:0].copy(), count
+            idx = np.arange(start, count) % self.capacity
+            return self.samples[idx], count
+
+    @staticmethod
+    def to_dict(sample):
+        # tolist() converts to plain python numbers, so the dict prints and logs cleanly
+        return dict(zip(TELEMETRY_DTYPE.names, sample.tolist()))
+
+
+class TelemetryReceiver:
+    """Drains every pending datagram from the UDP socket on each wakeup.
+
+    Telemetry (binary or text) goes into the ring buffer; every other packet is
+    handed to on_packet(packet, addr). After each drained batch that contained
+    telemetry, on_telemetry(addresses) is called once with the senders.
+    """
+
+    def __init__(self, sock, buffer, on_packet=None, on_telemetry=None, max_packet_size=1024, rcvbuf=1 << 20):
+        self.sock = sock
+        self.buffer = buffer
+        self.on_packet = on_packet
+        self.on_telemetry = on_telemetry
+        self.max_packet_size = max_packet_size
+        self.parser = SensorDataParser()
+        self.last_binary = False  # format of the last telemetry packet received
+        # stats
+        self.packets = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.bad_frames = 0
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        except OSError as e:
+            print(f"Could not enlarge the UDP receive buffer: {e}")
+
+    def run(self, stop_event=None, timeout=1.0):
+        # The socket is switched to non-blocking so the drain stops as soon as the
+        # kernel queue is empty; senders on other threads only use sendto, which
+        # does not block on UDP.
+        self.sock.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        try:
+            while stop_event is None or not stop_event.is_set():
+                if selector.select(timeout):
+                    self.drain()
+        finally:
+            selector.close()
+
+    def drain(self):
+        """Read every pending datagram, returns the number of telemetry samples stored."""
+        binary_frames = []
+        addresses = set()
+        stored = 0
+        received = 0
+        while True:
+            try:
+                packet, addr = self.sock.recvfrom(self.max_packet_size)
+            except (BlockingIOError, InterruptedError):
+                break
+            received += 1
+            if is_binary_telemetry(packet):
+                if len(packet) == TELEMETRY_STRUCT.size:
+                    binary_frames.append(packet)
+                    addresses.add(addr[0])
+                else:
+                    self.bad_frames += 1
+            elif packet.startswith(b"data"):
+                # keep the buffer in arrival order
+                stored += self._store_frames(binary_frames)
+                binary_frames = []
+                try:
+                    self.buffer.append(self.parser.parse_sensor_data(packet.decode()))
+                except ValueError:
+                    self.bad_frames += 1
+                    continue
+                self.last_binary = False
+                addresses.add(addr[0])
+                stored += 1
+            elif self.on_packet is not None:
+                self.on_packet(packet, addr)
+
+        stored += self._store_frames(binary_frames)
+
+        self.packets += received
+        if received:
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, received)
+        if addresses and self.on_telemetry is not None:
+            self.on_telemetry(addresses)
+        return stored
+
+    def _store_frames(self, binary_frames):
+        if not binary_frames:
+            return 0
+        frames = np.frombuffer(b"".join(binary_frames), dtype=TELEMETRY_WIRE_DTYPE)
+        valid = frames["version"] == TELEMETRY_VERSION
+        n_valid = int(valid.sum())
+        self.bad_frames += len(frames) - n_valid
+        if n_valid:
+            self.buffer.extend_frames(frames[valid])
+            self.last_binary = True
+        return n_valid
+
+
+if __name__ == "__main__":
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.setblocking(False)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver = TelemetryReceiver(server, TelemetryRingBuffer(64))
+
+    frames = np.zeros(4, dtype=TELEMETRY_WIRE_DTYPE)
+    frames["magic"] = b"BT"
+    frames["version"] = TELEMETRY_VERSION + 1
+    for frame in frames:
+        client.sendto(frame.tobytes(), server.getsockname())
+    time.sleep(0.05)
+    assert receiver.drain() == 0
+    assert not receiver.last_binary and receiver.bad_frames == 4
+
+    frames["version"] = TELEMETRY_VERSION
+    for frame in frames:
+        client.sendto(frame.tobytes(), server.getsockname())
+    time.sleep(0.05)
+    assert receiver.drain() == 4
+    assert receiver.last_binary and receiver.bad_frames == 4
+    print("ok:", receiver.packets, "packets,", receiver.bad_frames, "bad frames")
@@ -9,4 +9,4 @@ from .mlp import Mlp
 from .patch_embed import PatchEmbed
 from .swiglu_ffn import SwiGLUFFN, SwiGLUFFNFused
 from .block import NestedTensorBlock
-from .attention import MemEffAttention
+from .attention import MemEffAttention, set_attention_backend, get_attention_backend
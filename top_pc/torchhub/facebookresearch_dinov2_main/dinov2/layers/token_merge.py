@@ -0,0 +1,102 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# References:
+#   https://github.com/facebookresearch/ToMe/blob/main/tome/merge.py
+
+from typing import Callable, Tuple
+
+import torch
+from torch import Tensor
+
+
+def _identity(x: Tensor) -> Tensor:
+    return x
+
+
+def bipartite_soft_matching(metric: Tensor, r: int, protected: int = 1) -> Tuple[Callable, Callable]:
+    """
+    ToMe bipartite soft matching: the tokens are split alternately into sets A
+    and B, and the r tokens of A most similar (cosine) to a token of B are
+    merged into it. The first `protected` tokens (class and register tokens)
+    are never merged.
+
+    Returns (merge, unmerge). merge sums the merged tokens (so the caller can
+    do a size weighted average), unmerge copies every merged token back to all
+    the positions it came from.
+    """
+    n_rest = metric.shape[1] - protected
+    r = min(r, n_rest // 2)
+    if r <= 0:
+        return _identity, _identity
+
+    with torch.no_grad():
+        metric = metric[:, protected:]
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = metric[:, ::2], metric[:, 1::2]
+        scores = a @ b.transpose(-1, -2)
+
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        unm_idx = edge_idx[:, r:]  # tokens of A that stay
+        src_idx = edge_idx[:, :r]  # tokens of A merged into their best match in B
+        dst_idx = node_idx[..., None].gather(dim=1, index=src_idx)
+
+    def merge(x: Tensor) -> Tensor:
+        keep, x = x[:, :protected], x[:, protected:]
+        src, dst = x[:, ::2], x[:, 1::2]
+        B, t1, C = src.shape
+        unm = src.gather(dim=1, index=unm_idx.expand(B, t1 - r, C))
+        src = src.gather(dim=1, index=src_idx.expand(B, r, C))
+        dst = dst.scatter_add(1, dst_idx.expand(B, r, C), src)
+        return torch.cat([keep, unm, dst], dim=1)
+
+    def unmerge(x: Tensor) -> Tensor:
+        keep, x = x[:, :protected], x[:, protected:]
+        unm_len = unm_idx.shape[1]
+        unm, dst = x[:, :unm_len], x[:, unm_len:]
+        B, _, C = x.shape
+        src = dst.gather(dim=1, index=dst_idx.expand(B, r, C))
+        out = x.new_empty(B, n_rest, C)
+        out[:, 1::2] = dst
+        out.scatter_(1, (2 * unm_idx).expand(B, unm_len, C), unm)
+        out.scatter_(1, (2 * src_idx).expand(B, r, C), src)
+        return torch.cat([keep, out], dim=1)
+
+    return merge, unmerge
+
+
+class TokenMerger:
+    """
+    Merges r tokens per call across the blocks of one forward pass and
+    restores the full token layout of any intermediate output.
+
+    Merged tokens are size weighted averages of the tokens they contain (no
+    proportional attention, the attention layers are left untouched).
+    """
+
+    def __init__(self, r: int, protected: int = 1):
+        self.r = r
+        self.protected = protected
+        self.size = None
+        self.unmerges = []
+
+    def merge(self, x: Tensor) -> Tensor:
+        if self.size is None:
+            self.size = x.new_ones(x.shape[0], x.shape[1], 1)
+        merge, unmerge = bipartite_soft_matching(x, self.r, self.protected)
+        if merge is _identity:
+            return x
+        x = merge(x * self.size)
+        self.size = merge(self.size)
+        self.unmerges.append(unmerge)
+        return x / self.size
+
+    def restore(self, x: Tensor) -> Tensor:
+        """Undo every merge so far, x gets the token count the forward pass started with."""
+        for unmerge in reversed(self.unmerges):
+            x = unmerge(x)
+        return x
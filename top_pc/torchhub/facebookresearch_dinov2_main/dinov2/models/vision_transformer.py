@@ -19,6 +19,7 @@ import torch.utils.checkpoint
 from torch.nn.init import trunc_normal_
 
 from dinov2.layers import Mlp, PatchEmbed, SwiGLUFFNFused, MemEffAttention, NestedTensorBlock as Block
+from dinov2.layers.token_merge import TokenMerger
 
 
 logger = logging.getLogger("dinov2")
@@ -100,6 +101,11 @@ class DinoVisionTransformer(nn.Module):
 
         self.cls_token = nn.Parameter(torch.zeros(1, 1, embed_dim))
         self.pos_embed = nn.Parameter(torch.zeros(1, num_patches + self.num_tokens, embed_dim))
+        # interpolated pos_embed per input size, see interpolate_pos_encoding
+        self._pos_embed_cache = {}
+        self._pos_embed_cache_version = None
+        # fraction of the patch tokens merged away over the blocks, see set_token_merging
+        self.token_merge_ratio = 0.0
 
         if drop_path_uniform is True:
             dpr = [drop_path_rate] * depth
@@ -163,15 +169,56 @@ class DinoVisionTransformer(nn.Module):
         named_apply(init_weights_vit_timm, self)
 
     def interpolate_pos_encoding(self, x, w, h):
-        previous_dtype = x.dtype
-        npatch = x.shape[1] - 1
+        # The interpolated table only depends on the input size, so outside of
+        # training it is computed once per (size, dtype, device) and cached
+        if torch.is_grad_enabled() and self.pos_embed.requires_grad:
+            return self._interpolate_pos_encoding(x.shape[1] - 1, x.shape[-1], w, h, x.dtype)
+        return self._cached_pos_encoding(w, h, x.dtype, x.device)
+
+    def _cached_pos_encoding(self, w, h, dtype, device):
+        version = (self.pos_embed.data_ptr(), self.pos_embed._version)
+        if self._pos_embed_cache_version != version:
+            # pos_embed was replaced or modified in place (load_state_dict, .to(), optimizer step)
+            self._pos_embed_cache = {}
+            self._pos_embed_cache_version = version
+        w0, h0 = w // self.patch_size, h // self.patch_size
+        key = (w0, h0, dtype, device)
+        if key not in self._pos_embed_cache:
+            # a regular tensor even under inference_mode, so it can be used outside of it too
+            with torch.inference_mode(False), torch.no_grad():
+                pos_embed = self._interpolate_pos_encoding(w0 * h0, self.embed_dim, w, h, dtype)
+                self._pos_embed_cache[key] = pos_embed.to(device)
+        return self._pos_embed_cache[key]
+
+    def set_token_merging(self, ratio=0.0):
+        """
+        ToMe style token merging in get_intermediate_layers: before every block the
+        most similar patch tokens are merged, so that `ratio` of them are gone by the
+        last block, and the intermediate outputs are unmerged back to one token per
+        patch. 0 disables it.
+        """
+        assert 0.0 <= ratio < 1.0
+        self.token_merge_ratio = ratio
+
+    def _token_merger(self, x):
+        if not self.token_merge_ratio:
+            return None
+        protected = 1
+        r = int(self.token_merge_ratio * (x.shape[1] - protected) / self.n_blocks)
+        return TokenMerger(r, protected) if r > 0 else None
+
+    def precompute_pos_encoding(self, sizes, dtype=None, device=None):
+        """Fill the positional embedding cache for input sizes given as (height, width) in pixels."""
+        for height, width in sizes:
+            self._cached_pos_encoding(height, width, dtype or self.pos_embed.dtype, device or self.pos_embed.device)
+
+    def _interpolate_pos_encoding(self, npatch, dim, w, h, previous_dtype):
         N = self.pos_embed.shape[1] - 1
         if npatch == N and w == h:
             return self.pos_embed
         pos_embed = self.pos_embed.float()
         class_pos_embed = pos_embed[:, 0]
         patch_pos_embed = pos_embed[:, 1:]
-        dim = x.shape[-1]
         w0 = w // self.patch_size
         h0 = h // self.patch_size
         # we add a small number to avoid floating point error in the interpolation
@@ -240,10 +287,13 @@ class DinoVisionTransformer(nn.Module):
         # If n is an int, take the n last blocks. If it's a list, take them
         output, total_block_len = [], len(self.blocks)
         blocks_to_take = range(total_block_len - n, total_block_len) if isinstance(n, int) else n
+        merger = self._token_merger(x)
         for i, blk in enumerate(self.blocks):
+            if merger is not None:
+                x = merger.merge(x)
             x = blk(x)
             if i in blocks_to_take:
-                output.append(x)
+                output.append(x if merger is None else merger.restore(x))
         assert len(output) == len(blocks_to_take), f"only {len(output)} / {len(blocks_to_take)} blocks found"
         return output
 
@@ -252,11 +302,14 @@ class DinoVisionTransformer(nn.Module):
         output, i, total_block_len = [], 0, len(self.blocks[-1])
         # If n is an int, take the n last blocks. If it's a list, take them
         blocks_to_take = range(total_block_len - n, total_block_len) if isinstance(n, int) else n
+        merger = self._token_merger(x)
         for block_chunk in self.blocks:
             for blk in block_chunk[i:]:  # Passing the nn.Identity()
+                if merger is not None:
+                    x = merger.merge(x)
                 x = blk(x)
                 if i in blocks_to_take:
-                    output.append(x)
+                    output.append(x if merger is None else merger.restore(x))
                 i += 1
         assert len(output) == len(blocks_to_take), f"only {len(output)} / {len(blocks_to_take)} blocks found"
         return output